@@ -1,18 +1,26 @@
 from pathlib import Path
 from dotenv import load_dotenv
-import os, io, json, traceback, re, uuid, random, mimetypes, string, csv
+import os, sys, io, json, traceback, re, uuid, random, mimetypes, string, csv, hashlib, asyncio, sqlite3, heapq, threading, time
+import importlib.util
+from contextlib import closing
 from datetime import date, datetime, timedelta, timezone as dt_timezone
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import groupby
+from xml.sax.saxutils import escape as xml_escape
 import openai
+import httpx
 import gradio as gr
-from docx import Document
 import smtplib
 from email.message import EmailMessage
+from email.mime.application import MIMEApplication
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import RedirectResponse, HTMLResponse
 import jwt
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.templating import Jinja2Templates
 
 # --- ADDED --- Module loaded debug print
@@ -27,6 +35,11 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 CONFIG_DIR = Path(__file__).parent / "course_data"
 CONFIG_DIR.mkdir(exist_ok=True)
 PROGRESS_LOG_FILE = CONFIG_DIR / "student_progress_log.csv"
+PDF_CACHE_DIR = CONFIG_DIR / "pdf_cache"
+PDF_CACHE_DIR.mkdir(exist_ok=True)
+PDF_ANALYSIS_CACHE_DIR = PDF_CACHE_DIR / "analysis"
+PDF_ANALYSIS_CACHE_DIR.mkdir(exist_ok=True)
+LLM_CACHE_DB = CONFIG_DIR / "llm_cache.sqlite"
 
 SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT   = int(os.getenv("SMTP_PORT", 587))
@@ -43,6 +56,16 @@ APP_DOMAIN = os.getenv("APP_DOMAIN", "https://www.easyaitutor.com") # Ensure thi
 
 days_map = {"Monday":0, "Tuesday":1, "Wednesday":2, "Thursday":3,
             "Friday":4, "Saturday":5, "Sunday":6}
+# Setup form date dropdown choices
+YEARS = tuple(str(y) for y in range(datetime.now().year, datetime.now().year + 5))
+MONTHS = tuple(f"{m:02d}" for m in range(1, 13))
+DAYS_OF_MONTH = tuple(f"{d:02d}" for d in range(1, 32))
+
+# Bound str.format methods for the per-lesson plan lines (hot loop on long semesters)
+_LESSON_FMT = "**Lesson {} ({})**{}: {}".format
+_PAGE_REF_FMT = " (Approx. Ref. p. {})".format
+# "Name, email" roster lines; captures come back trimmed and lines without an email-shaped second field are skipped
+_ROSTER_RE = re.compile(r'^\s*([^,\r\n]+?)\s*,\s*([^\s,]+@[^\s,]+)\s*$', re.MULTILINE)
 
 # --- Student Tutor Configuration ---
 STUDENT_TTS_MODEL = "tts-1"
@@ -72,6 +95,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"]
 )
+# Requires starlette>=0.46 (pinned in requirements.txt): older GZipMiddleware also compresses text/event-stream,
+# buffering the SSE streams Gradio's queue uses for progress and results
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 # --- APScheduler Setup & Jobs ---
 scheduler = BackgroundScheduler(timezone="UTC")
@@ -81,82 +107,191 @@ scheduler = BackgroundScheduler(timezone="UTC")
 def healthz():
     return {"status": "ok", "scheduler_running": scheduler.running}
 
-# Attempt to import fitz (PyMuPDF)
+# PyMuPDF is required for all PDF text extraction, but only imported the first time a PDF is parsed,
+# so processes that never parse one (health checks, student sessions) don't load its shared libraries
+# Explicit minimal flags for plain-text extraction: keep whitespace, clip to the page; no image/ligature/span bookkeeping
+# (pymupdf.TEXT_PRESERVE_WHITESPACE | pymupdf.TEXT_MEDIABOX_CLIP)
+FITZ_TEXT_FLAGS = 2 | 64
+
+# Imported under its own name: current PyMuPDF prints a deprecation warning for the legacy "fitz" alias
+@lru_cache(maxsize=None)
+def _fitz():
+    import pymupdf
+    return pymupdf
+
+# Attempt to import aiosmtplib (async, concurrent email delivery)
 try:
-    import fitz
-    fitz_available = True
+    import aiosmtplib
+    aiosmtplib_available = True
 except ImportError:
-    fitz_available = False
-    print("PyMuPDF (fitz) not found. Page number mapping will be limited.")
+    aiosmtplib_available = False
+    print("aiosmtplib not found. Bulk emails will be sent sequentially in a worker thread.")
+
+# Attempt to import orjson (5-10x faster config (de)serialization)
+try:
+    import orjson
+    orjson_available = True
+except ImportError:
+    orjson_available = False
+
+def _read_json(path):
+    if orjson_available: return orjson.loads(path.read_bytes())
+    return json.loads(path.read_text(encoding="utf-8"))
+
+# Written to a temp file in the same directory and renamed over the target, so a crash or two overlapping saves
+# never leave a truncated file behind; readers see either the old or the new content
+def _write_json(path, obj, indent=False):
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        if orjson_available: tmp_path.write_bytes(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)))
+        else: tmp_path.write_text(json.dumps(obj, ensure_ascii=False, indent=2 if indent else None), encoding="utf-8")
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True); raise
+
+# Parsed course configs, keyed on path + mtime so a write from another process invalidates the entry too;
+# _save_cfg also clears this process's cache outright. Callers that mutate the result must copy it first.
+# A config holds the book's full text and sections (often several MB), so only the few courses in active use are kept
+@lru_cache(maxsize=4)
+def _load_cfg_at(path, mtime_ns): return _read_json(path)
+
+def _load_cfg(path): return _load_cfg_at(path, path.stat().st_mtime_ns)
+
+def _save_cfg(path, cfg):
+    _write_json(path, cfg, indent=True); _load_cfg_at.cache_clear()
 
 # --- PDF Processing & Helpers ---
+_HEADING_RE = re.compile(r"(?im)^(?:CHAPTER|Cap[ií]tulo|Sección|Section|Unit|Unidad|Part|Module)\s+[\d\w]+.*")
+_BOLD_RE = re.compile(r'(\*\*.*?\*\*)')
+
+def _read_pdf_bytes(pdf_file_obj):
+    if isinstance(pdf_file_obj, (str, os.PathLike)): return Path(pdf_file_obj).read_bytes()
+    if hasattr(pdf_file_obj, "name") and os.path.exists(pdf_file_obj.name): return Path(pdf_file_obj.name).read_bytes()
+    pdf_file_obj.seek(0); data = pdf_file_obj.read(); pdf_file_obj.seek(0)
+    return data
+
+# Plain "text" extraction in content-stream order; sort=True re-sorts every block by position, which is
+# extra work per page and not needed for heading detection on textbook layouts.
+# Pages whose content stream is mostly vector drawing (multi-MB of path operators for a few words of text)
+# are the pathological case for MuPDF text extraction, so they are skipped outright.
+MAX_PAGE_CONTENT_BYTES = 2_000_000
+def _page_text(page):
+    content_len = len(page.read_contents())
+    if content_len > MAX_PAGE_CONTENT_BYTES: print(f"Skipping graphics-heavy page {page.number + 1} ({content_len} content bytes)"); return ""
+    return page.get_text("text", flags=FITZ_TEXT_FLAGS)
+
+# Cache key for PDF-derived data; blake2b is faster than sha256 on multi-MB inputs and collision resistance is all we need
+def _pdf_digest(pdf_bytes): return hashlib.blake2b(pdf_bytes, digest_size=16).hexdigest()
+
+# PDF caches are keyed on the digest plus a hash of every setting that shapes the cached data, so changing an extraction
+# flag, the heading pattern or the analysis prompt starts fresh entries instead of serving stale ones.
+# Bump the "-vN" revision when the code producing an entry changes
+def _settings_hash(*settings): return hashlib.blake2b(repr(settings).encode("utf-8"), digest_size=6).hexdigest()
+_SECTIONS_CACHE_TAG = _settings_hash("sections-v1", FITZ_TEXT_FLAGS, MAX_PAGE_CONTENT_BYTES, _HEADING_RE.pattern)
+
+# PDF caches keep the most recently used _PDF_CACHE_MAX_FILES entries per directory; hits bump the mtime so eviction is LRU
+_PDF_CACHE_MAX_FILES = 50
+def _touch_cache_file(path):
+    try: path.touch()
+    except OSError: pass
+
+def _prune_cache_dir(cache_dir, keep=_PDF_CACHE_MAX_FILES):
+    entries = []
+    for p in cache_dir.glob("*.json"):
+        try: entries.append((p.stat().st_mtime_ns, p))
+        except OSError: pass
+    for _, p in sorted(entries, reverse=True)[keep:]:
+        try: p.unlink()
+        except OSError: pass
+
+# Cache entry at path, or None when it is missing or unreadable (e.g. truncated by a pre-atomic write): a bad entry is a miss
+def _read_cache_entry(path):
+    if not path.exists(): return None
+    try: entry = _read_json(path)
+    except Exception as e_cache: print(f"Ignoring unreadable cache entry {path.name}: {e_cache}"); return None
+    _touch_cache_file(path); return entry
+
+# Parsed sections are cached by PDF content hash, so re-saves (and other courses using the same textbook) skip parsing
 def split_sections(pdf_file_obj):
-    if hasattr(pdf_file_obj, "seek"): pdf_file_obj.seek(0)
-    if fitz_available:
-        try:
-            doc = None
-            if hasattr(pdf_file_obj, "name"): doc = fitz.open(pdf_file_obj.name)
-            elif hasattr(pdf_file_obj, "read"):
-                pdf_bytes_sec = pdf_file_obj.read(); pdf_file_obj.seek(0)
-                doc = fitz.open(stream=pdf_bytes_sec, filetype="pdf")
-            if not doc: raise Exception("Could not open PDF with fitz.")
-            pages_text = [page.get_text("text", sort=True) for page in doc]; doc.close()
-            headings = []
-            for i, text in enumerate(pages_text):
-                for m in re.finditer(r"(?im)^(?:CHAPTER|Cap[ií]tulo|Sección|Section|Unit|Unidad|Part|Module)\s+[\d\w]+.*", text):
-                    headings.append({"page": i + 1, "start_char_index": m.start(), "title": m.group().strip(), "page_index": i})
-            headings.sort(key=lambda h: (h['page_index'], h['start_char_index']))
-            sections = []
-            if not headings:
-                full_content = "\n".join(pages_text)
-                if full_content.strip(): sections.append({'title': 'Full Document Content', 'content': full_content.strip(), 'page': 1})
-                return sections
-            for idx, h in enumerate(headings):
-                current_page_idx, start_char = h['page_index'], h['start_char_index']; content = ''
-                if idx + 1 < len(headings):
-                    next_h = headings[idx+1]; next_page_idx, end_char = next_h['page_index'], next_h['start_char_index']
-                    if current_page_idx == next_page_idx: content += pages_text[current_page_idx][start_char:end_char]
-                    else:
-                        content += pages_text[current_page_idx][start_char:] + '\n'
-                        for p_idx in range(current_page_idx + 1, next_page_idx): content += pages_text[p_idx] + '\n'
-                        content += pages_text[next_page_idx][:end_char]
-                else:
-                    content += pages_text[current_page_idx][start_char:] + '\n'
-                    for p_idx in range(current_page_idx + 1, len(pages_text)): content += pages_text[p_idx] + '\n'
-                if content.strip(): sections.append({'title': h['title'], 'content': content.strip(), 'page': h['page']})
-            sections = [s for s in sections if len(s['content']) > len(s['title']) + 20]
-            return sections
-        except Exception as e_fitz: print(f"Error fitz splitting: {e_fitz}. Fallback.");
+    try: pdf_bytes = _read_pdf_bytes(pdf_file_obj)
+    except Exception as e_read: return [{'title': 'PDF Error', 'content': f'{e_read}', 'page': None}]
+    cache_path = PDF_CACHE_DIR / f"{_pdf_digest(pdf_bytes)}-{_SECTIONS_CACHE_TAG}.json"
+    if (sections := _read_cache_entry(cache_path)) is not None: return sections
+    sections = _split_pdf_bytes(pdf_bytes)
+    if sections and not (len(sections) == 1 and sections[0]['title'] == 'PDF Error'):
+        _write_json(cache_path, sections); _prune_cache_dir(PDF_CACHE_DIR)
+    return sections
+
+# Yields (1-based page number, text) one page at a time; only the current page is alive while callers consume it
+def _iter_pdf_pages(pdf_bytes):
+    with closing(_fitz().open(stream=pdf_bytes, filetype="pdf")) as doc:
+        for i in range(doc.page_count): yield i + 1, _page_text(doc.load_page(i))
+
+def _split_pdf_bytes(pdf_bytes):
     try:
-        from PyPDF2 import PdfReader
-        if hasattr(pdf_file_obj, "seek"): pdf_file_obj.seek(0)
-        reader = PdfReader(pdf_file_obj.name if hasattr(pdf_file_obj, "name") else pdf_file_obj)
-        text = "\n".join(page.extract_text() or '' for page in reader.pages)
-        chunks, sections, sents_per_sec = re.split(r'(?<=[.?!])\s+', text), [], 15
-        for i in range(0, len(chunks), sents_per_sec):
-            title, content = f"Content Block {i//sents_per_sec+1}", " ".join(chunks[i:i+sents_per_sec]).strip()
-            if content: sections.append({'title': title, 'content': content, 'page': None})
-        if not sections and text.strip(): sections.append({'title': 'Full Document (PyPDF2)', 'content': text.strip(), 'page': None})
-        return sections
-    except ImportError: return [{'title': 'PDF Error', 'content': 'PyPDF2 not found.', 'page': None}]
-    except Exception as e_pypdf2: return [{'title': 'PDF Error', 'content': f'{e_pypdf2}', 'page': None}]
-
-def download_docx(content, filename):
+        # Single pass: each page's text is cut at heading matches and appended to the open section,
+        # so only the current page (plus any pre-heading preamble) is held besides the sections themselves
+        sections, current, preamble = [], None, []
+        for page_no, text in _iter_pdf_pages(pdf_bytes):
+            pos = 0
+            for m in _HEADING_RE.finditer(text):
+                if current is None: preamble.clear()
+                else: current['parts'].append(text[pos:m.start()]); sections.append(current)
+                current, pos = {'title': m.group().strip(), 'parts': [], 'page': page_no}, m.start()
+            if current is None: preamble.append(text)
+            else: current['parts'].append(text[pos:])
+        if current is None:
+            full_content = "\n".join(preamble).strip()
+            return [{'title': 'Full Document Content', 'content': full_content, 'page': 1}] if full_content else []
+        sections.append(current)
+        sections = [{'title': sec['title'], 'content': content, 'page': sec['page']} for sec in sections if (content := "\n".join(sec['parts']).strip())]
+        return [s for s in sections if len(s['content']) > len(s['title']) + 20]
+    except Exception as e_fitz: print(f"Error fitz splitting: {e_fitz}"); return [{'title': 'PDF Error', 'content': f'{e_fitz}', 'page': None}]
+
+# Keyed on the output text only (the filename is applied at attach time), so repeated "Email" clicks on an unchanged syllabus/plan skip python-docx
+# Paragraph XML is written as one string and parsed by lxml in a single call, instead of one add_paragraph/add_run
+# tree mutation per line; runs mirror python-docx's own (tab -> <w:tab/>, CR -> <w:br/>, **bold** -> <w:b/>)
+def _docx_run_xml(text, bold=False):
+    rpr = "<w:rPr><w:b/></w:rPr>" if bold else ""
+    if not text: return f"<w:r>{rpr}</w:r>"
+    body = xml_escape(text).replace("\t", '</w:t><w:tab/><w:t xml:space="preserve">').replace("\r", '</w:t><w:br/><w:t xml:space="preserve">')
+    return f'<w:r>{rpr}<w:t xml:space="preserve">{body}</w:t></w:r>'.replace('<w:t xml:space="preserve"></w:t>', '')
+
+@lru_cache(maxsize=64)
+def _build_docx_bytes(content):
+    from docx import Document  # python-docx/lxml are only loaded once a document is actually built
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import nsdecls
     buf = io.BytesIO(); doc = Document()
+    paras = []
     for line in content.split("\n"):
-        p = doc.add_paragraph()
-        parts = re.split(r'(\*\*.*?\*\*)', line)
-        for part in parts:
-            if part.startswith('**') and part.endswith('**'): p.add_run(part[2:-2]).bold = True
-            else: p.add_run(part)
-    doc.save(buf); buf.seek(0); return buf, filename
+        if '**' not in line: paras.append(f"<w:p>{_docx_run_xml(line)}</w:p>"); continue
+        runs = "".join(_docx_run_xml(part[2:-2], bold=True) if part.startswith('**') and part.endswith('**') else _docx_run_xml(part) for part in _BOLD_RE.split(line))
+        paras.append(f"<w:p>{runs}</w:p>")
+    body = doc.element.body
+    fragment = parse_xml(f"<w:body {nsdecls('w')}>{''.join(paras)}</w:body>")
+    body[-1:-1] = list(fragment)  # before the trailing <w:sectPr>, where add_paragraph puts them
+    doc.save(buf); return buf.getvalue()
 
+def download_docx(content, filename):
+    return io.BytesIO(_build_docx_bytes(content)), filename
+
+# One arithmetic progression (step 7 days) per class weekday - only actual class dates are ever built;
+# the progressions are already sorted, so heapq.merge interleaves them without a full sort
+def list_class_dates(sd, ed, wdays):
+    runs = []
+    for wd in set(wdays):
+        first = sd + timedelta(days=(wd - sd.weekday()) % 7)
+        if first <= ed: runs.append([first + timedelta(weeks=k) for k in range((ed - first).days // 7 + 1)])
+    return list(heapq.merge(*runs))
+
+# Closed form: every full week contributes one class per weekday, then check the < 7 leftover days
 def count_classes(sd, ed, wdays):
-    cnt, cur = 0, sd
-    while cur <= ed:
-        if cur.weekday() in wdays: cnt += 1
-        cur += timedelta(days=1)
-    return cnt
+    total_days = (ed - sd).days + 1
+    if total_days <= 0: return 0
+    wdays, start_wd = set(wdays), sd.weekday()
+    full_weeks, extra_days = divmod(total_days, 7)
+    return full_weeks * len(wdays) + sum(1 for i in range(extra_days) if (start_wd + i) % 7 in wdays)
 
 def generate_access_token(student_id, course_id, lesson_id, lesson_date_obj=None):
     access_code = generate_5_digit_code()
@@ -176,11 +311,19 @@ def generate_access_token(student_id, course_id, lesson_id, lesson_date_obj=None
 
 def generate_5_digit_code(): return str(random.randint(10000, 99999))
 
-def send_email_notification(to_email, subject, html_content, from_name="User", attachment_file_obj=None):
-    if not SMTP_USER or not SMTP_PASS: print(f"CRITICAL SMTP ERROR: SMTP_USER or SMTP_PASS not configured. Cannot send email to {to_email}."); return False
+# Base64-encodes the payload once; the returned part can be attached to any number of messages
+def build_attachment_part(data, filename):
+    ctype, encoding = mimetypes.guess_type(filename)
+    if ctype is None or encoding is not None or not ctype.startswith('application/'): ctype = 'application/octet-stream'
+    part = MIMEApplication(data, _subtype=ctype.split('/', 1)[1])
+    part.add_header('Content-Disposition', 'attachment', filename=os.path.basename(filename))
+    return part
+
+def build_email_message(to_email, subject, html_content, from_name="User", attachment_file_obj=None, attachment_part=None):
     msg = EmailMessage(); msg["Subject"] = subject; msg["From"] = f"AI Tutor Panel <{SMTP_USER}>"; msg["To"] = to_email
     if to_email.lower() == SMTP_USER.lower() and "@" in from_name: msg.add_header('Reply-To', from_name)
     msg.add_alternative(html_content, subtype='html')
+    if attachment_part is not None: msg.make_mixed(); msg.attach(attachment_part)
     if attachment_file_obj and hasattr(attachment_file_obj, "name") and attachment_file_obj.name:
         try:
             file_path_to_read = attachment_file_obj.name
@@ -192,106 +335,324 @@ def send_email_notification(to_email, subject, html_content, from_name="User", a
             print(f"Attachment {os.path.basename(file_path_to_read)} prepared.")
         except FileNotFoundError: print(f"Error attaching: File not found at {file_path_to_read}")
         except Exception as e_attach: print(f"Error processing attachment {file_path_to_read}: {e_attach}")
+    return msg
+
+# Sends every message over one connection (one TLS handshake + login); returns a per-message success list
+def send_email_messages(msgs):
+    results = [False] * len(msgs)
+    if not msgs: return results
+    if not SMTP_USER or not SMTP_PASS: print(f"CRITICAL SMTP ERROR: SMTP_USER or SMTP_PASS not configured. Cannot send {len(msgs)} email(s)."); return results
     try:
-        print(f"Attempting to send email to {to_email} via {SMTP_SERVER}:{SMTP_PORT} as {SMTP_USER}...")
+        print(f"Attempting to send {len(msgs)} email(s) via {SMTP_SERVER}:{SMTP_PORT} as {SMTP_USER}...")
         with smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=20) as s:
             s.set_debuglevel(0)
-            s.starttls(); s.login(SMTP_USER, SMTP_PASS); s.send_message(msg)
-        print(f"Email successfully sent to {to_email}"); return True
-    except smtplib.SMTPAuthenticationError as e: print(f"SMTP Auth Error for {SMTP_USER}: {e}\n{traceback.format_exc()}"); return False
-    except smtplib.SMTPConnectError as e: print(f"SMTP Connect Error to {SMTP_SERVER}:{SMTP_PORT}: {e}\n{traceback.format_exc()}"); return False
-    except smtplib.SMTPServerDisconnected as e: print(f"SMTP Server Disconnected: {e}\n{traceback.format_exc()}"); return False
-    except smtplib.SMTPException as e: print(f"General SMTP Exception to {to_email}: {e}\n{traceback.format_exc()}"); return False
-    except Exception as e: print(f"Unexpected error sending email to {to_email}: {e}\n{traceback.format_exc()}"); return False
+            s.starttls(); s.login(SMTP_USER, SMTP_PASS)
+            for i, msg in enumerate(msgs):
+                try: s.send_message(msg); results[i] = True; print(f"Email successfully sent to {msg['To']}")
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e: print(f"SMTP rejected message to {msg['To']}: {e}")
+    except smtplib.SMTPAuthenticationError as e: print(f"SMTP Auth Error for {SMTP_USER}: {e}\n{traceback.format_exc()}")
+    except smtplib.SMTPConnectError as e: print(f"SMTP Connect Error to {SMTP_SERVER}:{SMTP_PORT}: {e}\n{traceback.format_exc()}")
+    except smtplib.SMTPServerDisconnected as e: print(f"SMTP Server Disconnected: {e}\n{traceback.format_exc()}")
+    except smtplib.SMTPException as e: print(f"General SMTP Exception: {e}\n{traceback.format_exc()}")
+    except Exception as e: print(f"Unexpected error sending email: {e}\n{traceback.format_exc()}")
+    return results
+
+def send_email_notification(to_email, subject, html_content, from_name="User", attachment_file_obj=None, attachment_part=None):
+    if not SMTP_USER or not SMTP_PASS: print(f"CRITICAL SMTP ERROR: SMTP_USER or SMTP_PASS not configured. Cannot send email to {to_email}."); return False
+    return send_email_messages([build_email_message(to_email, subject, html_content, from_name, attachment_file_obj, attachment_part)])[0]
+
+_SMTP_POOL_SIZE = 4  # concurrent SMTP connections for bulk sends (most providers throttle more than ~5)
+
+async def _send_over_connection(msgs):
+    results = [False] * len(msgs)
+    try:
+        async with aiosmtplib.SMTP(hostname=SMTP_SERVER, port=SMTP_PORT, start_tls=True, timeout=20) as client:
+            await client.login(SMTP_USER, SMTP_PASS)
+            for i, msg in enumerate(msgs):
+                try: await client.send_message(msg); results[i] = True; print(f"Email successfully sent to {msg['To']}")
+                except (aiosmtplib.SMTPRecipientsRefused, aiosmtplib.SMTPSenderRefused, aiosmtplib.SMTPDataError) as e: print(f"SMTP rejected message to {msg['To']}: {e}")
+    except aiosmtplib.SMTPAuthenticationError as e: print(f"SMTP Auth Error for {SMTP_USER}: {e}\n{traceback.format_exc()}")
+    except aiosmtplib.SMTPException as e: print(f"General SMTP Exception: {e}\n{traceback.format_exc()}")
+    except Exception as e: print(f"Unexpected error sending email: {e}\n{traceback.format_exc()}")
+    return results
+
+# Fans the messages out over a small pool of connections so total time ~ max instead of sum of send latencies
+# Without aiosmtplib each share goes through the blocking sender on its own worker thread (and its own connection)
+async def send_email_messages_async(msgs):
+    if not msgs: return []
+    if not SMTP_USER or not SMTP_PASS: print(f"CRITICAL SMTP ERROR: SMTP_USER or SMTP_PASS not configured. Cannot send {len(msgs)} email(s)."); return [False] * len(msgs)
+    n_conn = min(_SMTP_POOL_SIZE, len(msgs))
+    print(f"Attempting to send {len(msgs)} email(s) via {SMTP_SERVER}:{SMTP_PORT} as {SMTP_USER} over {n_conn} connection(s)...")
+    if aiosmtplib_available: shares = await asyncio.gather(*(_send_over_connection(msgs[k::n_conn]) for k in range(n_conn)))
+    else: shares = await asyncio.gather(*(asyncio.to_thread(send_email_messages, msgs[k::n_conn]) for k in range(n_conn)))
+    results = [False] * len(msgs)
+    for k, share in enumerate(shares): results[k::n_conn] = share
+    return results
+
+# --- Shared OpenAI clients: one keep-alive connection pool per process (HTTP/2 when the h2 package is installed) ---
+_OPENAI_HTTP2 = importlib.util.find_spec("h2") is not None
+_OPENAI_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+
+@lru_cache(maxsize=None)
+def _openai_client(): return openai.OpenAI(http_client=openai.DefaultHttpxClient(http2=_OPENAI_HTTP2, limits=_OPENAI_LIMITS))
+
+@lru_cache(maxsize=None)
+def _async_openai_client(): return openai.AsyncOpenAI(http_client=openai.DefaultAsyncHttpxClient(http2=_OPENAI_HTTP2, limits=_OPENAI_LIMITS))
+
+# --- OpenAI response cache (exact match on model + messages + params) ---
+# One connection per process, schema created when it is first opened. Cache calls run in asyncio.to_thread workers,
+# hence check_same_thread=False; the lock keeps them from using the connection concurrently
+_llm_cache_lock = threading.Lock()
+@lru_cache(maxsize=1)
+def _llm_cache_db():
+    conn = sqlite3.connect(LLM_CACHE_DB, timeout=10, check_same_thread=False)
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, response TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT)")
+    return conn
+
+def _llm_cache_key(kw): return hashlib.sha256(json.dumps(kw, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def _llm_cache_get(key):
+    try:
+        with _llm_cache_lock: row = _llm_cache_db().execute("SELECT response FROM cache WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e: print(f"LLM cache read error: {e}"); return None
+
+def _llm_cache_put(key, response):
+    try:
+        with _llm_cache_lock, _llm_cache_db() as conn: conn.execute("INSERT OR REPLACE INTO cache (key, response) VALUES (?, ?)", (key, response))
+    except sqlite3.Error as e: print(f"LLM cache write error: {e}")
+
+_LLM_RATE_LIMIT_RETRIES = 5
+
+# Drop-in for (await client.chat.completions.create(**kw)) that returns the message content.
+# Rate-limit errors are retried with exponential backoff + jitter so concurrent batches back off instead of failing
+async def cached_chat_async(client, **kw):
+    key = _llm_cache_key(kw); content = await asyncio.to_thread(_llm_cache_get, key)
+    if content is None:
+        for attempt in range(_LLM_RATE_LIMIT_RETRIES + 1):
+            try: content = (await client.chat.completions.create(**kw)).choices[0].message.content; break
+            except openai.RateLimitError:
+                if attempt == _LLM_RATE_LIMIT_RETRIES: raise
+                delay = 2 ** attempt + random.random(); print(f"OpenAI rate limit hit, retrying in {delay:.1f}s"); await asyncio.sleep(delay)
+        await asyncio.to_thread(_llm_cache_put, key, content)
+    return content
 
 # --- Syllabus & Lesson Plan Generation (Instructor Panel) ---
+# Fixed syllabus blocks, joined once at import
+_SYLLABUS_GRADING_BLOCK = "\n".join(["GRADING:", " • Quiz per class.", " • Retake if <60%.", " • Final = quiz avg."])
+_SYLLABUS_SUPPORT_BLOCK = "\n".join(["SUPPORT:", " • Office Hours: Tue 3–5PM; Thu 10–11AM (Zoom)", " • Email reply <24h weekdays"])
+
+# Header + schedule depend only on these scalars, so re-previews with unchanged course details reuse them
+@lru_cache(maxsize=128)
+def _syllabus_frame(course_name, instr_name, instr_email, start_date, end_date, class_days):
+    sd, ed = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    mr, total = f"{sd.strftime('%B')}–{ed.strftime('%B')}", count_classes(sd, ed, [days_map[d] for d in class_days])
+    header = "\n".join([f"Course: {course_name}", f"Prof: {instr_name}", f"Email: {instr_email}", f"Duration: {mr} ({total} classes)", '_'*60])
+    return header, f"SCHEDULE:\n • {mr}, {', '.join(class_days)}"
+
 def generate_syllabus(cfg):
-    sd, ed = datetime.strptime(cfg['start_date'], '%Y-%m-%d').date(), datetime.strptime(cfg['end_date'], '%Y-%m-%d').date()
-    mr, total = f"{sd.strftime('%B')}–{ed.strftime('%B')}", count_classes(sd, ed, [days_map[d] for d in cfg['class_days']])
-    header = [f"Course: {cfg['course_name']}", f"Prof: {cfg['instructor']['name']}", f"Email: {cfg['instructor']['email']}", f"Duration: {mr} ({total} classes)", '_'*60]
-    objectives = [f" • {o}" for o in cfg['learning_objectives']]
-    body = ["DESC:", cfg['course_description'], "", "OBJECTIVES:"] + objectives + ["", "GRADING:", " • Quiz per class.", " • Retake if <60%.", " • Final = quiz avg.", "", "SCHEDULE:", f" • {mr}, {', '.join(cfg['class_days'])}", "", "SUPPORT:", " • Office Hours: Tue 3–5PM; Thu 10–11AM (Zoom)", " • Email reply <24h weekdays"]
-    return "\n".join(header + [""] + body)
-
-def generate_plan_by_week_structured_and_formatted(cfg):
-    sd, ed = datetime.strptime(cfg['start_date'], '%Y-%m-%d').date(), datetime.strptime(cfg['end_date'], '%Y-%m-%d').date()
-    wdays = {days_map[d] for d in cfg['class_days']}
-    class_dates = [cur for cur in (sd + timedelta(i) for i in range((ed - sd).days + 1)) if cur.weekday() in wdays]
-    print(f"DEBUG: Class dates: {len(class_dates)}")
-    if not class_dates: return "No class dates.", []
-    full_text, char_map = cfg.get("full_text_content", ""), cfg.get("char_offset_page_map", [])
-    if not full_text.strip():
-        print("Warning: Full text empty.");
-        placeholder_lessons, placeholder_lines, weeks_ph = [], [], {}
-        for idx, dt in enumerate(class_dates):
-            wk_key = f"{dt.isocalendar()[0]}-W{dt.isocalendar()[1]:02d}"
-            ld = {"lesson_number": idx + 1, "date": dt.strftime('%Y-%m-%d'), "topic_summary": "Topic TBD (No PDF text)", "original_section_title": "N/A", "page_reference": None}
-            placeholder_lessons.append(ld); weeks_ph.setdefault(wk_key, []).append(ld)
-        for wk_key in sorted(weeks_ph.keys()):
-            yr, wk = wk_key.split("-W"); placeholder_lines.append(f"**Week {wk} (Year {yr})**\n")
-            for lsn in weeks_ph[wk_key]: placeholder_lines.append(f"**Lesson {lsn['lesson_number']} ({datetime.strptime(lsn['date'], '%Y-%m-%d').strftime('%B %d, %Y')})**: {lsn['topic_summary']}")
-            placeholder_lines.append('')
-        return "\n".join(placeholder_lines), placeholder_lessons
-
-    total_chars, num_lessons = len(full_text), len(class_dates)
+    header, schedule = _syllabus_frame(cfg['course_name'], cfg['instructor']['name'], cfg['instructor']['email'], cfg['start_date'], cfg['end_date'], tuple(cfg['class_days']))
+    objectives = "".join(f"\n • {o}" for o in cfg['learning_objectives'])
+    return f"{header}\n\nDESC:\n{cfg['course_description']}\n\nOBJECTIVES:{objectives}\n\n{_SYLLABUS_GRADING_BLOCK}\n\n{schedule}\n\n{_SYLLABUS_SUPPORT_BLOCK}"
+
+_SUMMARY_MODEL, _SUMMARY_PROMPT_VERSION = "gpt-3.5-turbo", "v1"  # bump the version when the summary prompt changes
+_SUMMARY_BATCH_SIZE = 20   # lesson segments per JSON-mode request
+_SUMMARY_GROUP_CHARS = 40000  # input chars per request (~10k tokens), keeps a group inside the model context
+_SUMMARY_CONCURRENCY = 8   # requests in flight at once
+_SUMMARY_SEGMENT_CHARS = 3000  # only the head of a lesson segment (~750 tokens) is sent; it's enough for a topic title
+
+# chat.completions kwargs for one JSON-mode request over a group of lesson segments (also the Batch API request body)
+def _summary_request(seg_texts):
+    numbered = "\n\n".join(f"[{n}] {t}" for n, t in enumerate(seg_texts, 1))
+    return dict(model=_SUMMARY_MODEL, response_format={"type": "json_object"}, messages=[{"role":"system","content":f"For EACH of the {len(seg_texts)} numbered text segments, identify its core concept as a short phrase (max 10-12 words) lesson topic title, preferably gerund (e.g., 'Using verbs'). NO full sentences. Return JSON: {{\"summaries\": [one title per segment, in input order]}}."}, {"role":"user","content": numbered}], temperature=0.4, max_tokens=min(4000, 40 * len(seg_texts) + 50))
+
+def _parse_summaries(content, seg_texts):
+    summaries = json.loads(content).get("summaries", [])
+    if len(summaries) != len(seg_texts): print(f"Warning: expected {len(seg_texts)} summaries, got {len(summaries)}")
+    return [str(x).strip().replace('"', '').capitalize() for x in summaries]
+
+# One JSON-mode request summarizes a whole group of lesson segments
+async def summarize_segments(client, seg_texts):
+    return _parse_summaries(await cached_chat_async(client, **_summary_request(seg_texts)), seg_texts)
+
+# Per-segment summary cache: unlike the whole-request cache it still hits when the same text is regrouped
+# (different class dates / lesson count move the batch boundaries)
+def _summary_key(seg_text): return hashlib.sha256(f"{_SUMMARY_MODEL}|{_SUMMARY_PROMPT_VERSION}|{seg_text}".encode("utf-8")).hexdigest()
+
+def _summary_cache_get(keys):
+    try:
+        with _llm_cache_lock: rows = [_llm_cache_db().execute("SELECT summary FROM summaries WHERE key = ?", (k,)).fetchone() for k in keys]
+        return [row[0] if row else None for row in rows]
+    except sqlite3.Error as e: print(f"Summary cache read error: {e}"); return [None] * len(keys)
+
+def _summary_cache_put(items):
+    try:
+        with _llm_cache_lock, _llm_cache_db() as conn: conn.executemany("INSERT OR REPLACE INTO summaries (key, summary) VALUES (?, ?)", items)
+    except sqlite3.Error as e: print(f"Summary cache write error: {e}")
+
+# Consecutive segments, at most _SUMMARY_BATCH_SIZE per group and (unless a single segment is bigger) _SUMMARY_GROUP_CHARS of text
+def _summary_groups(seg_texts):
+    groups, cur, cur_chars = [], [], 0
+    for t in seg_texts:
+        if cur and (len(cur) == _SUMMARY_BATCH_SIZE or cur_chars + len(t) > _SUMMARY_GROUP_CHARS): groups.append(cur); cur, cur_chars = [], 0
+        cur.append(t); cur_chars += len(t)
+    if cur: groups.append(cur)
+    return groups
+
+# Result is aligned with seg_texts, None where the summary could not be produced; only cache misses reach the API
+async def summarize_all_segments(seg_texts):
+    keys = [_summary_key(t) for t in seg_texts]
+    summaries = await asyncio.to_thread(_summary_cache_get, keys)
+    misses = [i for i, summ in enumerate(summaries) if summ is None]
+    print(f"DEBUG: {len(seg_texts) - len(misses)}/{len(seg_texts)} segment summaries cached")
+    if misses:
+        fresh = await _summarize_uncached([seg_texts[i] for i in misses])
+        for i, summ in zip(misses, fresh): summaries[i] = summ
+        await asyncio.to_thread(_summary_cache_put, [(keys[i], summ) for i, summ in zip(misses, fresh) if summ])
+    return summaries
+
+# Groups are summarized concurrently; a group that fails or comes back misaligned is retried one segment per call
+async def _summarize_uncached(seg_texts):
+    groups = _summary_groups(seg_texts)
+    sem = asyncio.Semaphore(_SUMMARY_CONCURRENCY)
+    client = _async_openai_client()
+    async def run_single(seg_text):
+        async with sem:
+            try: return (await summarize_segments(client, [seg_text]) or [None])[0]
+            except Exception as e: print(f"Error summarizing single seg: {e}"); return None
+    async def run_group(group_idx, group):
+        async with sem:
+            try: result = await summarize_segments(client, group)
+            except Exception as e: print(f"Error summarizing seg group {group_idx+1}: {e}"); result = []
+        if len(result) == len(group) or len(group) == 1: return result
+        print(f"Seg group {group_idx+1}: {len(result)}/{len(group)} summaries, falling back to one call per segment")
+        return list(await asyncio.gather(*(run_single(t) for t in group)))
+    results = await asyncio.gather(*(run_group(g_idx, g) for g_idx, g in enumerate(groups)))
+    summaries = []
+    for group, result in zip(groups, results): summaries.extend((result + [None] * len(group))[:len(group)])
+    return summaries
+
+_BATCH_DONE_STATUSES = {"completed", "failed", "expired", "cancelled"}
+BATCH_JOBS_DIR = CONFIG_DIR / "batch_jobs"
+BATCH_JOB_PAYLOADS_DIR = BATCH_JOBS_DIR / "payloads"
+BATCH_JOB_PAYLOADS_DIR.mkdir(parents=True, exist_ok=True)
+# Each job is polled on its own schedule: the interval doubles up to the max, so small batches are picked up quickly
+# and long ones aren't polled every few seconds for hours. The poller wakes every _BATCH_POLL_SECS to check due jobs
+_BATCH_POLL_SECS, _BATCH_POLL_MAX_SECS = 5, 300
+
+# OpenAI Batch API: half the price and separate rate limits, but results can take up to the 24h completion window,
+# so nothing waits on a batch: it is submitted, recorded as a job file, and collected later by _batch_job_poller
+async def _submit_chat_batch(bodies, label):
+    requests_jsonl = "\n".join(json.dumps({"custom_id": f"req_{i}", "method": "POST", "url": "/v1/chat/completions", "body": body}, ensure_ascii=False) for i, body in enumerate(bodies))
+    client = _async_openai_client()
+    batch_input = await client.files.create(file=(f"{label}.jsonl", requests_jsonl.encode("utf-8")), purpose="batch")
+    batch = await client.batches.create(input_file_id=batch_input.id, endpoint="/v1/chat/completions", completion_window="24h")
+    print(f"Submitted {label} batch {batch.id} ({len(bodies)} requests)")
+    return batch.id
+
+# None while the batch is still running; otherwise one content per submitted body, None where a request has no usable output
+async def _collect_chat_batch(batch_id, n_bodies):
+    client = _async_openai_client()
+    batch = await client.batches.retrieve(batch_id)
+    if batch.status not in _BATCH_DONE_STATUSES: return None
+    contents = [None] * n_bodies
+    if batch.status != "completed" or not batch.output_file_id: print(f"Batch {batch_id} ended as {batch.status}"); return contents
+    for line in (await client.files.content(batch.output_file_id)).text.splitlines():
+        if not line.strip(): continue
+        row = json.loads(line)
+        try: contents[int(row["custom_id"].split("_", 1)[1])] = row["response"]["body"]["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError, ValueError) as e: print(f"Error reading batch {batch_id} result {row.get('custom_id')}: {e}")
+    return contents
+
+# A job is a small metadata file (id, kind, batch_id, request count) that the poller reads every round, plus a payload
+# file with what is needed to apply the results (segment texts, parsed books), read only once the batch is done.
+# The payload is written first, so the poller never sees a job without one
+def _batch_payload_path(job_id): return BATCH_JOB_PAYLOADS_DIR / f"{job_id}.json"
+
+def _save_batch_job(job, payload=None):
+    if payload is not None: _write_json(_batch_payload_path(job["id"]), payload)
+    _write_json(BATCH_JOBS_DIR / f"{job['id']}.json", job)
+
+def _schedule_batch_poll(job, poll_secs):
+    job["poll_secs"], job["next_poll_at"] = poll_secs, time.time() + poll_secs
+
+def _new_batch_job(kind, batch_id, n_requests, **fields):
+    job = {"id": uuid.uuid4().hex, "kind": kind, "batch_id": batch_id, "n_requests": n_requests, **fields}
+    _schedule_batch_poll(job, _BATCH_POLL_SECS); return job
+
+def _remove_batch_job(job_id):
+    for path in (BATCH_JOBS_DIR / f"{job_id}.json", _batch_payload_path(job_id)): path.unlink(missing_ok=True)
+
+_MIN_SEGMENT_CHARS = 150
+
+# Lesson i covers an equal share of the full text: returns each segment's start offset and its (truncated) text
+# to summarize, None for segments too short to be worth a summary
+def _lesson_segments(full_text, num_lessons):
+    total_chars = len(full_text)
     chars_per_lesson = total_chars // num_lessons if num_lessons > 0 else total_chars
-    min_chars, summaries, cur_ptr, seg_starts = 150, [], 0, []
     print(f"DEBUG: Total chars: {total_chars}, Chars/lesson: {chars_per_lesson}")
+    seg_starts, seg_texts, cur_ptr = [], [], 0
     for i in range(num_lessons):
-        seg_starts.append(cur_ptr); start = cur_ptr
+        seg_starts.append(cur_ptr)
         end = cur_ptr + chars_per_lesson if i < num_lessons - 1 else total_chars
-        seg_text, cur_ptr = full_text[start:end].strip(), end
-        if len(seg_text) < min_chars: summaries.append("Review or brief topic.")
-        else:
-            try:
-                print(f"DEBUG: Summarizing seg {i+1} (len {len(seg_text)}): '{seg_text[:70].replace(chr(10),' ')}...'")
-                resp = openai.chat.completions.create(model="gpt-3.5-turbo", messages=[{"role":"system","content":"Identify core concept. Respond ONLY with short phrase (max 10-12 words) as lesson topic title, preferably gerund (e.g., 'Using verbs'). NO full sentences."}, {"role":"user","content": seg_text}], temperature=0.4, max_tokens=30)
-                summaries.append(resp.choices[0].message.content.strip().replace('"', '').capitalize())
-            except Exception as e: print(f"Error summarizing seg {i+1}: {e}"); summaries.append(f"Topic seg {i+1} (Summary Error)")
+        seg_text, cur_ptr = full_text[seg_starts[-1]:end].strip(), end
+        seg_texts.append(seg_text[:_SUMMARY_SEGMENT_CHARS] if len(seg_text) >= _MIN_SEGMENT_CHARS else None)
+    return seg_starts, seg_texts
 
-    lessons_by_course_week = {}
+async def generate_plan_by_week_structured_and_formatted(cfg):
+    sd, ed = date.fromisoformat(cfg['start_date']), date.fromisoformat(cfg['end_date'])
+    class_dates = list_class_dates(sd, ed, [days_map[d] for d in cfg['class_days']])
+    print(f"DEBUG: Class dates: {len(class_dates)}")
+    if not class_dates: return "No class dates.", []
+    full_text, char_map = cfg.get("full_text_content", ""), cfg.get("char_offset_page_map", [])
+    date_labels = [dt.strftime('%B %d, %Y') for dt in class_dates]
+    # Monday-based week number (date.min is a Monday) - one int op per date instead of isocalendar()/monday arithmetic
+    week_nums = [(dt.toordinal() - 1) // 7 for dt in class_dates]
+    if not full_text.strip():
+        print("Warning: Full text empty.");
+        placeholder_lessons = [{"lesson_number": idx + 1, "date": dt.strftime('%Y-%m-%d'), "topic_summary": "Topic TBD (No PDF text)", "original_section_title": "N/A", "page_reference": None} for idx, dt in enumerate(class_dates)]
+        buf = io.StringIO()
+        for week_no, (_, week_idxs) in enumerate(groupby(range(len(class_dates)), key=week_nums.__getitem__)):
+            week_idxs = list(week_idxs); iso = class_dates[week_idxs[0]].isocalendar()
+            if week_no: buf.write("\n")
+            buf.write(f"**Week {iso.week:02d} (Year {iso.year})**\n\n")
+            for idx in week_idxs: buf.write(_LESSON_FMT(idx + 1, date_labels[idx], '', placeholder_lessons[idx]['topic_summary']) + "\n")
+        return buf.getvalue(), placeholder_lessons
+
+    seg_starts, seg_texts = _lesson_segments(full_text, len(class_dates))
+    summaries = ["Review or brief topic." if t is None else None for t in seg_texts]
+    to_summarize = {i: t for i, t in enumerate(seg_texts) if t is not None}
+    if to_summarize:
+        print(f"DEBUG: Summarizing {len(to_summarize)} segs in groups of <= {_SUMMARY_BATCH_SIZE}")
+        for i, summ in zip(to_summarize, await summarize_all_segments(list(to_summarize.values()))):
+            summaries[i] = summ or f"Topic seg {i+1} (Summary Error)"
+
+    # Page of a segment = page of the last char_map offset <= its start (char_map is sorted by offset)
+    map_offsets = [offset for offset, _ in char_map]
     structured_lessons = []
-    if not class_dates: return "No class dates to process.", []
-    course_week_counter = 0
-    current_week_monday_for_grouping = None
-
-    for idx, dt_obj in enumerate(class_dates):
-        monday_of_this_week = dt_obj - timedelta(days=dt_obj.weekday())
-        if current_week_monday_for_grouping is None or monday_of_this_week > current_week_monday_for_grouping:
-            course_week_counter += 1
-            current_week_monday_for_grouping = monday_of_this_week
-        year_of_this_course_week = monday_of_this_week.year
-        course_week_key = f"{year_of_this_course_week}-CW{course_week_counter:02d}"
-        summary_for_lesson = summaries[idx]
-        est_pg = None
-        if char_map:
-            seg_start = seg_starts[idx]
-            for offset, pg in reversed(char_map):
-                if seg_start >= offset: est_pg = pg; break
-            if est_pg is None and char_map: est_pg = char_map[0][1]
-        lesson_data = {
+    for idx, (dt_obj, seg_start, summ) in enumerate(zip(class_dates, seg_starts, summaries)):
+        est_pg = char_map[max(bisect_right(map_offsets, seg_start) - 1, 0)][1] if char_map else None
+        structured_lessons.append({
             "lesson_number": idx + 1,
             "date": dt_obj.strftime('%Y-%m-%d'),
-            "topic_summary": summary_for_lesson,
+            "topic_summary": summ,
             "original_section_title": f"Text Segment {idx+1}",
             "page_reference": est_pg
-        }
-        structured_lessons.append(lesson_data)
-        lessons_by_course_week.setdefault(course_week_key, []).append(lesson_data)
-
-    formatted_lines = []
-    for course_week_key in sorted(lessons_by_course_week.keys()):
-        year_disp, course_week_num_disp_str = course_week_key.split("-CW")
-        course_week_num_disp = int(course_week_num_disp_str)
-        first_date_in_this_week_group = lessons_by_course_week[course_week_key][0]['date']
-        first_date_obj = datetime.strptime(first_date_in_this_week_group, '%Y-%m-%d')
-        formatted_lines.append(f"**Course Week {course_week_num_disp} (Year {first_date_obj.year})**\n")
-        for lesson in lessons_by_course_week[course_week_key]:
-            ds = datetime.strptime(lesson['date'], '%Y-%m-%d').strftime('%B %d, %Y')
-            pstr = f" (Approx. Ref. p. {lesson['page_reference']})" if lesson['page_reference'] else ''
-            formatted_lines.append(f"**Lesson {lesson['lesson_number']} ({ds})**{pstr}: {lesson['topic_summary']}")
-        formatted_lines.append('')
-    return "\n".join(formatted_lines), structured_lessons
+        })
+
+    # class_dates is sorted, so consecutive lessons sharing a week number form one course week
+    buf = io.StringIO()
+    for course_week_num, (_, week_idxs) in enumerate(groupby(range(len(class_dates)), key=week_nums.__getitem__), 1):
+        week_idxs = list(week_idxs)
+        if course_week_num > 1: buf.write("\n")
+        buf.write(f"**Course Week {course_week_num} (Year {class_dates[week_idxs[0]].year})**\n\n")
+        for idx in week_idxs:
+            lesson = structured_lessons[idx]
+            pstr = _PAGE_REF_FMT(lesson['page_reference']) if lesson['page_reference'] else ''
+            buf.write(_LESSON_FMT(lesson['lesson_number'], date_labels[idx], pstr, lesson['topic_summary']) + "\n")
+    return buf.getvalue(), structured_lessons
 
 # This function was duplicated, removing one instance.
 # def generate_access_token(student_id, course_id, lesson_id, lesson_date_obj=None):
@@ -314,14 +675,16 @@ def send_daily_class_reminders():
     today_utc = datetime.now(dt_timezone.utc).date()
     for config_file in CONFIG_DIR.glob("*_config.json"):
         try:
-            cfg = json.loads(config_file.read_text(encoding="utf-8"))
+            cfg = _load_cfg(config_file)
             course_id, course_name = config_file.stem.replace("_config", ""), cfg.get("course_name", "N/A")
             if not cfg.get("lessons") or not cfg.get("students"): continue
             for lesson in cfg["lessons"]:
-                lesson_date = datetime.strptime(lesson["date"], '%Y-%m-%d').date()
+                lesson_date = date.fromisoformat(lesson["date"])
                 if lesson_date == today_utc:
                     print(f"SCHEDULER: Class found for {course_name} today: Lesson {lesson['lesson_number']}")
                     # class_code = generate_5_digit_code() # This code isn't used in the current email template for link access
+                    if not SMTP_USER or not SMTP_PASS: print(f"SCHEDULER: SMTP not configured, reminders for {course_name} not sent."); continue
+                    reminder_msgs = []
                     for student in cfg["students"]:
                         student_id, student_email, student_name = student.get("id", "unknown"), student.get("email"), student.get("name", "Student")
                         if not student_email: continue
@@ -338,7 +701,8 @@ def send_daily_class_reminders():
                             <p>The link and code are valid for {LINK_VALIDITY_HOURS} hours from generation, typically covering morning to early afternoon UTC on {today_utc.strftime('%B %d, %Y')}.</p>
                             <p>Best regards,<br>AI Tutor System</p>
                         </div></body></html>"""
-                        send_email_notification(student_email, email_subject, email_html_body, student_name)
+                        reminder_msgs.append(build_email_message(student_email, email_subject, email_html_body, student_name))
+                    send_email_messages(reminder_msgs)
         except Exception as e: print(f"SCHEDULER: Error in daily reminders for {config_file.name}: {e}\n{traceback.format_exc()}")
 
 def log_student_progress(student_id, course_id, lesson_id, quiz_score_str, session_duration_secs, engagement_notes="N/A"):
@@ -381,7 +745,7 @@ def check_student_progress_and_notify_professor():
         config_path = CONFIG_DIR / f"{course_id}_config.json"
         if config_path.exists():
             try:
-                cfg = json.loads(config_path.read_text(encoding="utf-8"))
+                cfg = _load_cfg(config_path)
                 instructor_email = cfg.get("instructor", {}).get("email")
                 instructor_name = cfg.get("instructor", {}).get("name", "Instructor")
                 course_name = cfg.get("course_name", course_id)
@@ -403,14 +767,36 @@ def _get_syllabus_text_from_config(course_name_str):
     if not course_name_str: return "Error: Course name missing."
     path = CONFIG_DIR / f"{course_name_str.replace(' ','_').lower()}_config.json"
     if not path.exists(): return f"Error: Config for '{course_name_str}' not found."
-    try: return generate_syllabus(json.loads(path.read_text(encoding="utf-8")))
+    try: return _cached_syllabus(path, path.stat().st_mtime_ns)
     except Exception as e: return f"Error loading syllabus: {e}"
 
+# Rendered syllabus per config file version; a rewrite of the config changes its mtime and so the key.
+# Also persisted next to the config, so other workers and restarts read a few hundred bytes of text
+# instead of parsing the whole config JSON (sections + full PDF text) just to rebuild it. The file name carries a render
+# tag (static blocks + a revision to bump when generate_syllabus/_syllabus_frame change), so a deploy that changes the
+# rendering doesn't keep serving the old text
+_SYLLABUS_RENDER_TAG = _settings_hash("syllabus-v1", _SYLLABUS_GRADING_BLOCK, _SYLLABUS_SUPPORT_BLOCK)
+def _syllabus_cache_path(cfg_path): return cfg_path.with_name(cfg_path.name.replace("_config.json", f"_syllabus-{_SYLLABUS_RENDER_TAG}.txt"))
+
+@lru_cache(maxsize=64)
+def _cached_syllabus(path, mtime_ns):
+    txt_path = _syllabus_cache_path(path)
+    try:
+        if txt_path.stat().st_mtime_ns >= mtime_ns: return txt_path.read_text(encoding="utf-8")
+    except OSError: pass
+    syllabus_text = generate_syllabus(_load_cfg(path))
+    try:
+        txt_path.write_text(syllabus_text, encoding="utf-8")
+        for stale_path in path.parent.glob(path.name.replace("_config.json", "_syllabus*.txt")):
+            if stale_path != txt_path: stale_path.unlink(missing_ok=True)
+    except OSError as e: print(f"Could not persist syllabus {txt_path.name}: {e}")
+    return syllabus_text
+
 def _get_plan_text_from_config(course_name_str):
     if not course_name_str: return "Error: Course name missing."
     path = CONFIG_DIR / f"{course_name_str.replace(' ','_').lower()}_config.json"
     if not path.exists(): return f"Error: Config for '{course_name_str}' not found."
-    try: return json.loads(path.read_text(encoding="utf-8")).get("lesson_plan_formatted", "Plan not generated.")
+    try: return _load_cfg(path).get("lesson_plan_formatted", "Plan not generated.")
     except Exception as e: return f"Error loading plan: {e}"
 
 def enable_edit_syllabus_and_reload(current_course_name, current_output_content):
@@ -427,61 +813,284 @@ def enable_edit_plan_and_reload(current_course_name_for_plan, current_plan_outpu
         return gr.update(value=plan_text, interactive=True)
     return gr.update(interactive=True)
 
-def save_setup(course_name, instr_name, instr_email, devices, pdf_file, sy, sm, sd_day, ey, em, ed_day, class_days_selected, students_input_str):
+_DIGEST_SNIPPET_CHARS = 800
+_DIGEST_CHAR_BUDGET = 24000  # ~6000 tokens at ~4 chars/token
+_DIGEST_TOC_CHARS = 6000     # share of the budget for the table of contents
+
+# Table of contents (every section title, so sampling below never hides a chapter) + title/snippet entries;
+# long books are sampled uniformly across sections to stay under the budget
+def _course_digest(sections):
+    toc = "\n".join(s['title'] for s in sections)
+    if len(toc) > _DIGEST_TOC_CHARS: toc = toc[:_DIGEST_TOC_CHARS].rsplit("\n", 1)[0]
+    budget = _DIGEST_CHAR_BUDGET - len(toc)
+    entries = [f"Title: {s['title']}\nSnippet: {s['content'][:_DIGEST_SNIPPET_CHARS]}" for s in sections]
+    total = sum(len(e) + 2 for e in entries)
+    if total > budget:
+        keep = max(1, len(entries) * budget // total)
+        entries = [entries[i * len(entries) // keep] for i in range(keep)]
+    # Hard cap: sampling bounds the entry count, but an overlong heading line could still push past the budget
+    return ("Contents:\n" + toc + "\n\n" + "\n\n".join(entries))[:_DIGEST_CHAR_BUDGET]
+
+# Full text + char-offset→page map for the plan's page references; sections_for_desc_obj is the fallback when fitz can't read it
+def _extract_full_text(pdf_file, sections_for_desc_obj):
+    full_pdf_text, page_texts, char_offset_to_page_map, current_char_offset = "", [], [], 0
+    try:
+        for page_no, page_text in _iter_pdf_pages(_read_pdf_bytes(pdf_file)):
+            if page_text: char_offset_to_page_map.append((current_char_offset, page_no)); page_texts.append(page_text); current_char_offset += len(page_text) + 1
+        # Joined once at the end (each page followed by "\n") instead of repeated str += per page
+        if page_texts: full_pdf_text = "\n".join(page_texts) + "\n"
+    except Exception as e_fitz_full: print(f"Error extracting full text with fitz: {e_fitz_full}")
+
+    if not full_pdf_text.strip():
+        print("Warning: Fitz failed for full text extraction, using concatenated sections. Page map will be empty or less accurate.")
+        full_pdf_text = "\n".join(s['content'] for s in sections_for_desc_obj); char_offset_to_page_map = []
+
+    if not full_pdf_text.strip(): return None, "⚠️ Error: Extracted PDF text is empty."
+    return (full_pdf_text, char_offset_to_page_map), None
+
+_COURSE_ANALYSIS_PROMPT = "From the course material, write a concise course description (2-3 sentences) and 5–10 clear, actionable learning objectives, each starting with a verb. Return JSON: {\"description\": string, \"objectives\": [one string per objective]}."
+
+# chat.completions kwargs for the description + objectives request (also the Batch API request body)
+def _course_analysis_request(digest):
+    return dict(model="gpt-3.5-turbo", response_format={"type": "json_object"}, messages=[{"role":"system","content": _COURSE_ANALYSIS_PROMPT},{"role":"user","content": digest}])
+
+# Objectives occasionally still arrive bulleted inside the JSON strings; the syllabus adds its own " • "
+_BULLET_STRIP = " -•*\t"
+def _course_analysis(sections_for_desc_obj, extracted, course_content):
+    full_pdf_text, char_offset_to_page_map = extracted
+    course_json = json.loads(course_content)
+    desc = str(course_json.get("description", "")).strip()
+    objs = [o for o in (str(x).strip(_BULLET_STRIP) for x in course_json.get("objectives", [])) if o]
+    return {"sections_for_description": sections_for_desc_obj, "full_text_content": full_pdf_text, "char_offset_page_map": char_offset_to_page_map, "course_description": desc, "learning_objectives": objs}
+
+def _sections_error(sections):
+    if not sections or (len(sections) == 1 and "Error" in sections[0]['title']): return "⚠️ Error: Could not extract structural sections from PDF for analysis."
+    return None
+
+# The expensive half of save_setup: PDF parsing (worker thread) + the OpenAI description/objectives call (awaited). Depends only on the PDF bytes.
+async def _analyze_course_pdf(pdf_file):
+    sections_for_desc_obj = await asyncio.to_thread(split_sections, pdf_file)
+    if (error_message := _sections_error(sections_for_desc_obj)): return None, error_message
+    # One request returns both the description and the objectives, so the digest is uploaded once;
+    # the full-text pass (only needed for page references) runs in a worker thread while that request is in flight
+    client = _async_openai_client()
+    (extracted, error_message), course_content = await asyncio.gather(
+        asyncio.to_thread(_extract_full_text, pdf_file, sections_for_desc_obj),
+        cached_chat_async(client, **_course_analysis_request(_course_digest(sections_for_desc_obj))))
+    if error_message: return None, error_message
+    return _course_analysis(sections_for_desc_obj, extracted, course_content), None
+
+def _setup_input_error(course_name, instr_name, instr_email, pdf_file, sy, sm, sd_day, ey, em, ed_day, class_days_selected):
+    if not all([course_name, instr_name, instr_email, pdf_file, sy, sm, sd_day, ey, em, ed_day, class_days_selected]): return "⚠️ Error: All fields marked with * are required."
+    try:
+        start_dt, end_dt = datetime(int(sy), int(sm), int(sd_day)), datetime(int(ey), int(em), int(ed_day))
+        if end_dt <= start_dt: return "⚠️ Error: End date must be after start date."
+    except ValueError: return "⚠️ Error: Invalid date selected."
+    return None
+
+# Covers the extraction (sections + full text), the digest layout and the request itself (prompt, model, format)
+_ANALYSIS_CACHE_TAG = _settings_hash("analysis-v1", _SECTIONS_CACHE_TAG, _DIGEST_SNIPPET_CHARS, _DIGEST_CHAR_BUDGET, _DIGEST_TOC_CHARS, _course_analysis_request(""), _BULLET_STRIP)
+def _analysis_cache_path(pdf_bytes): return PDF_ANALYSIS_CACHE_DIR / f"{_pdf_digest(pdf_bytes)}-{_ANALYSIS_CACHE_TAG}.json"
+
+# Analyses are cached by PDF digest; only misses are analyzed. Result is aligned with pdf_files as (analysis, error_message) pairs
+async def _course_analyses(pdf_files):
+    results, misses = [None] * len(pdf_files), []
+    for i, pdf_file in enumerate(pdf_files):
+        pdf_cache_path = _analysis_cache_path(await asyncio.to_thread(_read_pdf_bytes, pdf_file))
+        if (analysis := await asyncio.to_thread(_read_cache_entry, pdf_cache_path)) is not None: print(f"Reusing cached PDF analysis {pdf_cache_path.name}"); results[i] = (analysis, None)
+        else: misses.append((i, pdf_cache_path))
+    for i, pdf_cache_path in misses:
+        results[i] = (analysis, error_message) = await _analyze_course_pdf(pdf_files[i])
+        if analysis: await asyncio.to_thread(_write_json, pdf_cache_path, analysis)
+    if misses: await asyncio.to_thread(_prune_cache_dir, PDF_ANALYSIS_CACHE_DIR)
+    return results
+
+def _save_course_cfg(course_name, instr_name, instr_email, devices, sy, sm, sd_day, ey, em, ed_day, class_days_selected, students_input_str, analysis):
+    parsed_students = [{"id": str(uuid.uuid4()), "name": n, "email": e} for n, e in _ROSTER_RE.findall(students_input_str or "")]
+    cfg = {"course_name": course_name, "instructor": {"name": instr_name, "email": instr_email}, "class_days": class_days_selected, "start_date": date(int(sy), int(sm), int(sd_day)).isoformat(), "end_date": date(int(ey), int(em), int(ed_day)).isoformat(), "allowed_devices": devices, "students": parsed_students, "sections_for_description": analysis["sections_for_description"], "full_text_content": analysis["full_text_content"], "char_offset_page_map": analysis["char_offset_page_map"], "course_description": analysis["course_description"], "learning_objectives": analysis["learning_objectives"], "lessons": [], "lesson_plan_formatted": ""}
+    _save_cfg(CONFIG_DIR / f"{course_name.replace(' ','_').lower()}_config.json", cfg)
+    return cfg
+
+async def save_setup(course_name, instr_name, instr_email, devices, pdf_file, sy, sm, sd_day, ey, em, ed_day, class_days_selected, students_input_str, use_batch_api=False):
     def error_return_tuple(error_message_str):
         return (gr.update(value=error_message_str, visible=True, interactive=False), gr.update(visible=True), None, gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), gr.update(value="", visible=False), gr.update(visible=True), gr.update(visible=False))
+    def queued_return_tuple(status_str):
+        return (gr.update(value=f"{status_str}\nThe course is saved automatically when its Batch API job completes (up to 24 hours).", visible=True, interactive=False), gr.update(visible=True), None, gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), gr.update(visible=False), gr.update(value="", visible=False), gr.update(visible=True, value="### Course Setup Queued\nThis course is being analyzed through the Batch API. Generate the Lesson Plan once the job has completed and the course is saved."), gr.update(visible=False))
     try:
-        if not all([course_name, instr_name, instr_email, pdf_file, sy, sm, sd_day, ey, em, ed_day, class_days_selected]): return error_return_tuple("⚠️ Error: All fields marked with * are required.")
-        try:
-            start_dt, end_dt = datetime(int(sy), int(sm), int(sd_day)), datetime(int(ey), int(em), int(ed_day))
-            if end_dt <= start_dt: return error_return_tuple("⚠️ Error: End date must be after start date.")
-        except ValueError: return error_return_tuple("⚠️ Error: Invalid date selected.")
-
-        sections_for_desc_obj = split_sections(pdf_file)
-        if not sections_for_desc_obj or (len(sections_for_desc_obj) == 1 and "Error" in sections_for_desc_obj[0]['title']):
-             return error_return_tuple("⚠️ Error: Could not extract structural sections from PDF for analysis.")
-
-        full_pdf_text, char_offset_to_page_map, current_char_offset = "", [], 0
-        fitz_available_for_full_text = fitz_available
-        if fitz_available_for_full_text:
-            doc_for_full_text = None
-            try:
-                if hasattr(pdf_file, "seek"): pdf_file.seek(0)
-                if hasattr(pdf_file, "name"): doc_for_full_text = fitz.open(pdf_file.name)
-                elif hasattr(pdf_file, "read"):
-                    pdf_bytes = pdf_file.read(); pdf_file.seek(0)
-                    doc_for_full_text = fitz.open(stream=pdf_bytes, filetype="pdf")
-                if doc_for_full_text:
-                    for page_num_fitz, page_obj in enumerate(doc_for_full_text):
-                        page_text = page_obj.get_text("text", sort=True)
-                        if page_text: char_offset_to_page_map.append((current_char_offset, page_num_fitz + 1)); full_pdf_text += page_text + "\n"; current_char_offset += len(page_text) + 1
-                    doc_for_full_text.close()
-                else: fitz_available_for_full_text = False
-            except Exception as e_fitz_full: print(f"Error extracting full text with fitz: {e_fitz_full}"); fitz_available_for_full_text = False
-
-        if not fitz_available_for_full_text or not full_pdf_text.strip():
-            print("Warning: Fitz failed or not used for full text extraction, using concatenated sections. Page map will be empty or less accurate.")
-            if hasattr(pdf_file, "seek"): pdf_file.seek(0)
-            temp_sections = split_sections(pdf_file)
-            full_pdf_text = "\n".join(s['content'] for s in temp_sections); char_offset_to_page_map = []
-
-        if not full_pdf_text.strip(): return error_return_tuple("⚠️ Error: Extracted PDF text is empty.")
-
-        full_content_for_ai_desc = "\n\n".join(f"Title: {s['title']}\nSnippet: {s['content'][:1000]}" for s in sections_for_desc_obj)
-        r1 = openai.chat.completions.create(model="gpt-3.5-turbo", messages=[{"role":"system","content":"Generate a concise course description (2-3 sentences)."},{"role":"user","content": full_content_for_ai_desc}])
-        desc = r1.choices[0].message.content.strip()
-        r2 = openai.chat.completions.create(model="gpt-3.5-turbo", messages=[{"role":"system","content":"Generate 5–10 clear, actionable learning objectives. Start each with a verb."},{"role":"user","content": full_content_for_ai_desc}])
-        objs = [ln.strip(" -•*") for ln in r2.choices[0].message.content.splitlines() if ln.strip()]
-        parsed_students = [{"id": str(uuid.uuid4()), "name": n.strip(), "email": e.strip()} for ln in students_input_str.splitlines() if ',' in ln for n, e in [ln.split(',', 1)]]
-        cfg = {"course_name": course_name, "instructor": {"name": instr_name, "email": instr_email}, "class_days": class_days_selected, "start_date": f"{sy}-{sm}-{sd_day}", "end_date": f"{ey}-{em}-{ed_day}", "allowed_devices": devices, "students": parsed_students, "sections_for_description": sections_for_desc_obj, "full_text_content": full_pdf_text, "char_offset_page_map": char_offset_to_page_map, "course_description": desc, "learning_objectives": objs, "lessons": [], "lesson_plan_formatted": ""}
-        path = CONFIG_DIR / f"{course_name.replace(' ','_').lower()}_config.json"
-        path.write_text(json.dumps(cfg, ensure_ascii=False, indent=2), encoding="utf-8")
+        if (error_message := _setup_input_error(course_name, instr_name, instr_email, pdf_file, sy, sm, sd_day, ey, em, ed_day, class_days_selected)): return error_return_tuple(error_message)
+
+        # PDF parsing and the multi-MB cache/config JSON I/O run in worker threads and the OpenAI call is awaited,
+        # so the event loop keeps serving other clients
+        if use_batch_api:
+            # Submit-and-return: queued unless the analysis is already cached, in which case the course is saved right away
+            [status] = await submit_setup_batch([dict(course_name=course_name, instr_name=instr_name, instr_email=instr_email, devices=devices, pdf_file=pdf_file, sy=sy, sm=sm, sd_day=sd_day, ey=ey, em=em, ed_day=ed_day, class_days_selected=class_days_selected, students_input_str=students_input_str)])
+            if status.endswith(_SETUP_QUEUED): return queued_return_tuple(status)
+            if not status.endswith(_SETUP_SAVED): return error_return_tuple(status)
+            cfg = await asyncio.to_thread(_load_cfg, CONFIG_DIR / f"{course_name.replace(' ','_').lower()}_config.json")
+        else:
+            [(analysis, error_message)] = await _course_analyses([pdf_file])
+            if error_message: return error_return_tuple(error_message)
+            cfg = await asyncio.to_thread(_save_course_cfg, course_name, instr_name, instr_email, devices, sy, sm, sd_day, ey, em, ed_day, class_days_selected, students_input_str, analysis)
         syllabus_text = generate_syllabus(cfg)
         return (gr.update(value=syllabus_text, visible=True, interactive=False), gr.update(visible=False), None, gr.update(visible=True), gr.update(visible=True), gr.update(visible=True), gr.update(visible=False), gr.update(visible=False), gr.update(visible=True), gr.update(visible=True), gr.update(value="", visible=False), gr.update(visible=False), gr.update(visible=True, value=course_name))
     except openai.APIError as oai_err: print(f"OpenAI Error: {oai_err}\n{traceback.format_exc()}"); return error_return_tuple(f"⚠️ OpenAI API Error: {oai_err}.")
     except Exception as e: print(f"Error in save_setup: {e}\n{traceback.format_exc()}"); return error_return_tuple(f"⚠️ Error: {e}")
 
-def generate_plan_callback(course_name_from_input):
+# Setup without waiting on the API, from Save Setup's batch mode or for bulk onboarding (python ai_tutor_full.py
+# batch-setup setups.json): each setup is a dict of save_setup's arguments. PDFs are parsed now and setups whose analysis
+# is already cached are saved right away; the remaining description/objectives requests go out as one Batch API job that
+# _batch_job_poller saves when it completes. Returns one status line per setup
+_SETUP_REQUIRED_FIELDS = ("course_name", "instr_name", "instr_email", "pdf_file", "sy", "sm", "sd_day", "ey", "em", "ed_day", "class_days_selected")
+_SETUP_SAVED, _SETUP_QUEUED = "✅ Saved.", "⏳ Queued for the Batch API."
+async def submit_setup_batch(setups):
+    statuses, entries, bodies = [None] * len(setups), [], []
+    for i, setup in enumerate(setups):
+        label = setup.get("course_name") or f"Setup {i+1}"
+        if (error_message := _setup_input_error(*(setup.get(k) for k in _SETUP_REQUIRED_FIELDS))): statuses[i] = f"{label}: {error_message}"; continue
+        try:
+            pdf_cache_path = _analysis_cache_path(await asyncio.to_thread(_read_pdf_bytes, setup["pdf_file"]))
+            if (analysis := await asyncio.to_thread(_read_cache_entry, pdf_cache_path)) is not None: statuses[i] = await asyncio.to_thread(_save_batch_setup, setup, analysis); continue
+            sections = await asyncio.to_thread(split_sections, setup["pdf_file"])
+            if (error_message := _sections_error(sections)): statuses[i] = f"{label}: {error_message}"; continue
+            extracted, error_message = await asyncio.to_thread(_extract_full_text, setup["pdf_file"], sections)
+            if error_message: statuses[i] = f"{label}: {error_message}"; continue
+            kw = _course_analysis_request(_course_digest(sections)); key = _llm_cache_key(kw)
+            # The job payload carries everything needed to finish the setup, so the PDF need not exist when the batch completes
+            entry = {"setup": {k: v for k, v in setup.items() if k != "pdf_file"}, "analysis_path": str(pdf_cache_path), "cache_key": key, "sections": sections, "extracted": list(extracted)}
+            if (content := await asyncio.to_thread(_llm_cache_get, key)) is not None: statuses[i] = await asyncio.to_thread(_finish_batch_setup, entry, content); continue
+            entries.append(entry); bodies.append(kw); statuses[i] = f"{label}: {_SETUP_QUEUED}"
+        except Exception as e: print(f"Error in submit_setup_batch for {label}: {e}\n{traceback.format_exc()}"); statuses[i] = f"{label}: ⚠️ Error: {e}"
+    if entries:
+        job = _new_batch_job("setup", await _submit_chat_batch(bodies, "course_analysis"), len(bodies), course_names=[e["setup"]["course_name"] for e in entries])
+        await asyncio.to_thread(_save_batch_job, job, {"entries": entries}); print(f"Batch job {job['id']}: {len(entries)} course setups will be saved when the batch completes.")
+    return statuses
+
+def _save_batch_setup(setup, analysis):
+    try:
+        _save_course_cfg(setup["course_name"], setup["instr_name"], setup["instr_email"], setup.get("devices") or ["PC"], setup["sy"], setup["sm"], setup["sd_day"], setup["ey"], setup["em"], setup["ed_day"], setup["class_days_selected"], setup.get("students_input_str", ""), analysis)
+        return f"{setup['course_name']}: {_SETUP_SAVED}"
+    except Exception as e: print(f"Error saving batch setup {setup['course_name']}: {e}\n{traceback.format_exc()}"); return f"{setup['course_name']}: ⚠️ Error: {e}"
+
+def _finish_batch_setup(entry, course_content):
+    try: analysis = _course_analysis(entry["sections"], entry["extracted"], course_content)
+    except ValueError as e: return f"{entry['setup']['course_name']}: ⚠️ Error: Unreadable course description response: {e}"
+    _write_json(Path(entry["analysis_path"]), analysis); _prune_cache_dir(PDF_ANALYSIS_CACHE_DIR)
+    return _save_batch_setup(entry["setup"], analysis)
+
+# False while the batch is still running
+async def _advance_setup_job(job):
+    contents = await _collect_chat_batch(job["batch_id"], job["n_requests"])
+    if contents is None: return False
+    payload = await asyncio.to_thread(_read_json, _batch_payload_path(job["id"]))
+    for entry, content in zip(payload["entries"], contents):
+        if content is None: print(f"{entry['setup']['course_name']}: ⚠️ Error: The Batch API returned no course description."); continue
+        await asyncio.to_thread(_llm_cache_put, entry["cache_key"], content)
+        print(await asyncio.to_thread(_finish_batch_setup, entry, content))
+    return True
+
+# Plan batch mode: uncached segment summaries go out as one Batch API job and the callback returns right away;
+# _batch_job_poller caches the summaries when the job completes and then builds the plan from the cache.
+# None when every summary is already cached, so the plan can be built straight away
+async def _submit_plan_job(course_name, cfg):
+    class_dates = list_class_dates(date.fromisoformat(cfg['start_date']), date.fromisoformat(cfg['end_date']), [days_map[d] for d in cfg['class_days']])
+    full_text = cfg.get("full_text_content", "")
+    if not class_dates or not full_text.strip(): return None
+    seg_texts = [t for t in _lesson_segments(full_text, len(class_dates))[1] if t is not None]
+    cached = await asyncio.to_thread(_summary_cache_get, [_summary_key(t) for t in seg_texts])
+    misses = list(dict.fromkeys(t for t, summ in zip(seg_texts, cached) if summ is None))
+    if not misses: return None
+    groups = _summary_groups(misses)
+    job = _new_batch_job("plan", await _submit_chat_batch([_summary_request(g) for g in groups], "plan_summaries"), len(groups), course_name=course_name, submitted_at=time.time())
+    await asyncio.to_thread(_save_batch_job, job, {"groups": groups})
+    return job
+
+# Metadata of the plan job still queued for course_name (one per course), or None
+def _pending_plan_job(course_name):
+    course_key = course_name.replace(' ','_').lower()
+    for path in BATCH_JOBS_DIR.glob("*.json"):
+        try: job = _read_json(path)
+        except Exception: continue
+        if job.get("kind") == "plan" and job["course_name"].replace(' ','_').lower() == course_key: return job
+    return None
+
+# False while a batch is still running. A group reply without exactly one summary per segment can't be matched to its
+# segments, so none of it is cached and those segments go out again as a follow-up batch of one-segment requests;
+# whatever is still missing after that is summarized realtime by the plan build
+async def _advance_plan_job(job):
+    contents = await _collect_chat_batch(job["batch_id"], job["n_requests"])
+    if contents is None: return False
+    payload = await asyncio.to_thread(_read_json, _batch_payload_path(job["id"]))
+    fresh, retry = [], []
+    for g_idx, (group, content) in enumerate(zip(payload["groups"], contents)):
+        result = []
+        if content is not None:
+            try: result = _parse_summaries(content, group)
+            except (TypeError, ValueError) as e: print(f"Error reading batch result for seg group {g_idx+1}: {e}")
+        if len(result) == len(group) or (len(group) == 1 and result): fresh.extend(zip(group, result))
+        elif len(group) > 1: print(f"Seg group {g_idx+1}: {len(result)}/{len(group)} summaries, resubmitting one request per segment"); retry.extend(group)
+    await asyncio.to_thread(_summary_cache_put, [(_summary_key(t), summ) for t, summ in fresh if summ])
+    if retry:
+        payload["groups"] = [[t] for t in retry]
+        job["batch_id"], job["n_requests"] = await _submit_chat_batch([_summary_request(g) for g in payload["groups"]], "plan_summaries_retry"), len(retry)
+        _schedule_batch_poll(job, _BATCH_POLL_SECS)
+        await asyncio.to_thread(_save_batch_job, job, payload); return False
+    config_path = CONFIG_DIR / f"{job['course_name'].replace(' ','_').lower()}_config.json"
+    if not config_path.exists(): print(f"Batch job {job['id']}: config for '{job['course_name']}' no longer exists, plan not built."); return True
+    # A plan generated realtime after this job was submitted is newer: keep it (and don't resend first-lesson emails)
+    if (await asyncio.to_thread(_load_cfg, config_path)).get("lesson_plan_generated_at", 0) > job["submitted_at"]:
+        print(f"Batch job {job['id']}: '{job['course_name']}' already has a newer lesson plan, summaries cached only."); return True
+    await _build_and_save_plan(config_path, job["course_name"])
+    print(f"Batch job {job['id']}: lesson plan for '{job['course_name']}' generated and saved.")
+    return True
+
+# Generates the plan, saves it to the course config and sends the first-lesson emails when lesson 1 is today
+async def _build_and_save_plan(config_path, course_name):
+    cfg = dict(await asyncio.to_thread(_load_cfg, config_path))
+    formatted_plan_str, structured_lessons_list = await generate_plan_by_week_structured_and_formatted(cfg)
+    cfg["lessons"] = structured_lessons_list
+    cfg["lesson_plan_formatted"] = formatted_plan_str
+    cfg["lesson_plan_generated_at"] = time.time()
+    await asyncio.to_thread(_save_cfg, config_path, cfg)
+
+    today_iso    = date.today().isoformat()
+    first_lesson = cfg["lessons"][0] if cfg["lessons"] else None
+    print(f"DEBUG [generate_plan]: today={today_iso}, lesson1 date={first_lesson['date'] if first_lesson else None}")
+
+    if first_lesson and first_lesson["date"] == today_iso:
+        first_lesson_recipients, first_lesson_msgs = [], []
+        for student_info in cfg["students"]:
+            token, access_code = generate_access_token(
+                student_info["id"],
+                course_name.replace(" ", "_").lower(),
+                first_lesson["lesson_number"],
+                date.fromisoformat(first_lesson["date"])
+            )
+            access_link = f"{APP_DOMAIN}/class?token={token}"
+            print(f"DEBUG [generate_plan]: sending email to {student_info['email']} → {access_link}")
+            html_body = f"""
+            <html><head><style>body {{font-family: sans-serif;}} strong {{color: #007bff;}} a {{color: #0056b3;}} .container {{padding: 20px; border: 1px solid #ddd; border-radius: 5px;}} .code {{font-size: 1.5em; font-weight: bold; background-color: #f0f0f0; padding: 5px 10px;}}</style></head>
+            <body><div class="container">
+                <p>Hi {student_info['name']},</p>
+                <p>Your course <strong>{cfg['course_name']}</strong> starts <strong>today</strong>!</p>
+                <p><strong>Your access code is:</strong> <span class="code">{access_code}</span></p>
+                <p>Access link: <a href="{access_link}">{access_link}</a></p>
+                <p>The link and code are valid for {LINK_VALIDITY_HOURS} hours from generation.</p>
+                <p>Good luck!<br>AI Tutor System</p>
+            </div></body></html>
+            """
+            first_lesson_recipients.append(student_info["email"])
+            first_lesson_msgs.append(build_email_message(
+                student_info["email"],
+                f"{cfg['course_name']} — Your Class Link for Today",
+                html_body
+            ))
+        if SMTP_USER and SMTP_PASS:
+            for student_email, sent in zip(first_lesson_recipients, await send_email_messages_async(first_lesson_msgs)):
+                print(f"DEBUG [generate_plan]: email sent to {student_email}? {sent}")
+        else: print("DEBUG [generate_plan]: SMTP not configured, first-lesson emails not sent.")
+    return cfg, formatted_plan_str
+
+async def generate_plan_callback(course_name_from_input, use_batch_api=False):
     def error_return_for_plan(error_message_str):
         return (
             gr.update(value=error_message_str, visible=True, interactive=False),
@@ -491,6 +1100,15 @@ def generate_plan_callback(course_name_from_input):
             gr.update(visible=False),
             gr.update(visible=False),
         )
+    def queued_return_for_plan(status_message_str):
+        return (
+            gr.update(value=status_message_str, visible=True, interactive=False),
+            None, None,
+            gr.update(visible=True),
+            None, None,
+            gr.update(visible=False),
+            gr.update(visible=False),
+        )
 
     try:
         if not course_name_from_input:
@@ -500,43 +1118,14 @@ def generate_plan_callback(course_name_from_input):
         if not config_path.exists():
             return error_return_for_plan(f"⚠️ Error: Config for '{course_name_from_input}' not found.")
 
-        cfg = json.loads(config_path.read_text(encoding="utf-8"))
-        formatted_plan_str, structured_lessons_list = generate_plan_by_week_structured_and_formatted(cfg)
-        cfg["lessons"] = structured_lessons_list
-        cfg["lesson_plan_formatted"] = formatted_plan_str
-        config_path.write_text(json.dumps(cfg, ensure_ascii=False, indent=2), encoding="utf-8")
-
-        today_iso    = date.today().isoformat()
-        first_lesson = cfg["lessons"][0] if cfg["lessons"] else None
-        print(f"DEBUG [generate_plan]: today={today_iso}, lesson1 date={first_lesson['date'] if first_lesson else None}")
-
-        if first_lesson and first_lesson["date"] == today_iso:
-            for student_info in cfg["students"]:
-                token, access_code = generate_access_token(
-                    student_info["id"],
-                    course_name_from_input.replace(" ", "_").lower(),
-                    first_lesson["lesson_number"],
-                    datetime.strptime(first_lesson["date"], "%Y-%m-%d").date()
-                )
-                access_link = f"{APP_DOMAIN}/class?token={token}"
-                print(f"DEBUG [generate_plan]: sending email to {student_info['email']} → {access_link}")
-                html_body = f"""
-                <html><head><style>body {{font-family: sans-serif;}} strong {{color: #007bff;}} a {{color: #0056b3;}} .container {{padding: 20px; border: 1px solid #ddd; border-radius: 5px;}} .code {{font-size: 1.5em; font-weight: bold; background-color: #f0f0f0; padding: 5px 10px;}}</style></head>
-                <body><div class="container">
-                    <p>Hi {student_info['name']},</p>
-                    <p>Your course <strong>{cfg['course_name']}</strong> starts <strong>today</strong>!</p>
-                    <p><strong>Your access code is:</strong> <span class="code">{access_code}</span></p>
-                    <p>Access link: <a href="{access_link}">{access_link}</a></p>
-                    <p>The link and code are valid for {LINK_VALIDITY_HOURS} hours from generation.</p>
-                    <p>Good luck!<br>AI Tutor System</p>
-                </div></body></html>
-                """
-                sent = send_email_notification(
-                    student_info["email"],
-                    f"{cfg['course_name']} — Your Class Link for Today",
-                    html_body
-                )
-                print(f"DEBUG [generate_plan]: email sent to {student_info['email']}? {sent}")
+        if use_batch_api:
+            # One paid batch per course at a time; a realtime generation meanwhile supersedes the job's plan (see _advance_plan_job)
+            if (job := await asyncio.to_thread(_pending_plan_job, course_name_from_input)):
+                return queued_return_for_plan(f"⏳ A Batch API job (job {job['id']}) is already generating this course's lesson plan. It is saved automatically when the batch completes; uncheck Batch mode to generate it now instead.")
+            if (job := await _submit_plan_job(course_name_from_input, await asyncio.to_thread(_load_cfg, config_path))):
+                return queued_return_for_plan(f"📨 Submitted {job['n_requests']} summary requests to the Batch API (job {job['id']}). The lesson plan is generated and saved to this course automatically when the batch completes (up to 24 hours).")
+
+        cfg, formatted_plan_str = await _build_and_save_plan(config_path, course_name_from_input)
 
         class_days_str = ", ".join(cfg.get("class_days", ["configured schedule"]))
         notification_message = (
@@ -563,26 +1152,22 @@ def generate_plan_callback(course_name_from_input):
         print(f"Error in generate_plan_callback: {e}\n{traceback.format_exc()}")
         return error_return_for_plan(f"⚠️ Error: {e}")
 
-def email_document_callback(course_name, doc_type, output_text_content, students_input_str):
+# Roster was parsed once in save_setup and stored in cfg["students"]; instructor first
+def _course_recipients(cfg, instr_name, instr_email):
+    return ([{"name":instr_name, "email":instr_email}] if instr_email else []) + [{"name":st.get("name", "Student"), "email":st["email"]} for st in cfg.get("students", []) if st.get("email")]
+
+async def email_document_callback(course_name, doc_type, output_text_content, use_bcc=False):
     if not SMTP_USER or not SMTP_PASS: return gr.update(value="⚠️ Error: SMTP settings not configured.")
     try:
         if not course_name or not output_text_content: return gr.update(value=f"⚠️ Error: Course Name & {doc_type} content required.")
         path = CONFIG_DIR / f"{course_name.replace(' ','_').lower()}_config.json"
         if not path.exists(): return gr.update(value=f"⚠️ Error: Config for '{course_name}' not found.")
-        cfg = json.loads(path.read_text(encoding="utf-8")); instr_name, instr_email = cfg.get("instructor", {}).get("name", "Instructor"), cfg.get("instructor", {}).get("email")
-        
-        buf, fn = download_docx(output_text_content, f"{course_name.replace(' ','_')}_{doc_type.lower()}.docx")
-        temp_file_path = Path(fn)
-        with open(temp_file_path, 'wb') as tmp_f:
-            tmp_f.write(buf.getvalue())
+        cfg = await asyncio.to_thread(_load_cfg, path); instr_name, instr_email = cfg.get("instructor", {}).get("name", "Instructor"), cfg.get("instructor", {}).get("email")
         
-        class MockFile:
-            def __init__(self, path):
-                self.name = str(path)
+        fn = f"{course_name.replace(' ','_')}_{doc_type.lower()}.docx"
+        attachment_part = build_attachment_part(await asyncio.to_thread(_build_docx_bytes, output_text_content), fn)
 
-        attachment_obj_for_email = MockFile(temp_file_path)
-
-        recipients = ([{"name":instr_name, "email":instr_email}] if instr_email else []) + [{"name":n.strip(), "email":e.strip()} for ln in students_input_str.splitlines() if ',' in ln for n,e in [ln.split(',',1)]]
+        recipients = _course_recipients(cfg, instr_name, instr_email)
         if not recipients: return gr.update(value="⚠️ Error: No recipients.")
         
         s_count = 0
@@ -596,17 +1181,18 @@ def email_document_callback(course_name, doc_type, output_text_content, students
         </body></html>
         """
 
-        for rec in recipients:
-            personalized_html_body = html_email_body.replace("{{recipient_name}}", rec['name'])
-            subject = f"{doc_type.capitalize()}: {course_name}"
-            
-            if send_email_notification(rec["email"], subject, personalized_html_body, from_name=SMTP_USER, attachment_file_obj=attachment_obj_for_email):
-                s_count += 1
-            else:
-                errs.append(f"Failed to send to {rec['email']}. Check logs for SMTP errors.")
-
-        if temp_file_path.exists():
-            os.remove(temp_file_path)
+        subject = f"{doc_type.capitalize()}: {course_name}"
+        # BCC mode: one message (attachment uploaded once) addressed to the sender, every recipient blind-copied
+        if use_bcc:
+            msg = build_email_message(SMTP_USER, subject, html_email_body.replace("{{recipient_name}}", "everyone"), from_name=SMTP_USER, attachment_part=attachment_part)
+            msg["Bcc"] = ", ".join(rec["email"] for rec in recipients)
+            if (await send_email_messages_async([msg]))[0]: s_count = len(recipients)
+            else: errs.append(f"Failed to send the BCC email to {len(recipients)} recipient(s). Check logs for SMTP errors.")
+            recipients = []
+        msgs = [build_email_message(rec["email"], subject, html_email_body.replace("{{recipient_name}}", rec['name']), from_name=SMTP_USER, attachment_part=attachment_part) for rec in recipients]
+        for rec, sent in zip(recipients, await send_email_messages_async(msgs)):
+            if sent: s_count += 1
+            else: errs.append(f"Failed to send to {rec['email']}. Check logs for SMTP errors.")
 
         status = f"✅ {doc_type.capitalize()} sent attempt to {s_count} recipient(s)."
         if errs: status += f"\n⚠️ Errors:\n" + "\n".join(errs)
@@ -614,8 +1200,16 @@ def email_document_callback(course_name, doc_type, output_text_content, students
 
     except Exception as e: err_txt = f"⚠️ Emailing Err:\n{traceback.format_exc()}"; print(err_txt); return gr.update(value=err_txt)
 
-def email_syllabus_callback(c, s_str, out_content): return email_document_callback(c, "Syllabus", out_content, s_str)
-def email_plan_callback(c, s_str, out_content): return email_document_callback(c, "Lesson Plan", out_content, s_str)
+async def email_syllabus_callback(c, out_content, use_bcc=False): return await email_document_callback(c, "Syllabus", out_content, use_bcc)
+async def email_plan_callback(c, out_content, use_bcc=False): return await email_document_callback(c, "Lesson Plan", out_content, use_bcc)
+
+# Wraps a slow handler as an async generator: the first yield puts a status line in the output box so the user
+# gets feedback immediately, the second yields the handler's real result
+def _with_progress(handler, n_outputs, message):
+    async def run(*args):
+        yield (gr.update(value=message, visible=True, interactive=False),) + (gr.update(),) * (n_outputs - 1)
+        yield await handler(*args)
+    return run
 
 # --- Build Instructor UI ---
 def build_instructor_ui():
@@ -632,22 +1226,22 @@ def build_instructor_ui():
                 with gr.Row():
                     with gr.Column(scale=2):
                         gr.Markdown("#### Course Schedule")
-                        years = [str(y) for y in range(datetime.now().year, datetime.now().year + 5)]
-                        months = [f"{m:02d}" for m in range(1, 13)]
-                        days_list = [f"{d:02d}" for d in range(1, 32)]
-                        with gr.Row(): sy, sm, sd_day = gr.Dropdown(years, label="Start Year*"), gr.Dropdown(months, label="Start Month*"), gr.Dropdown(days_list, label="Start Day*")
-                        with gr.Row(): ey, em, ed_day = gr.Dropdown(years, label="End Year*"), gr.Dropdown(months, label="End Month*"), gr.Dropdown(days_list, label="End Day*")
+                        with gr.Row(): sy, sm, sd_day = gr.Dropdown(list(YEARS), label="Start Year*"), gr.Dropdown(list(MONTHS), label="Start Month*"), gr.Dropdown(list(DAYS_OF_MONTH), label="Start Day*")
+                        with gr.Row(): ey, em, ed_day = gr.Dropdown(list(YEARS), label="End Year*"), gr.Dropdown(list(MONTHS), label="End Month*"), gr.Dropdown(list(DAYS_OF_MONTH), label="End Day*")
                         class_days_selected = gr.CheckboxGroup(list(days_map.keys()), label="Class Days*")
                     with gr.Column(scale=1):
                         gr.Markdown("#### Student & Access")
                         devices = gr.CheckboxGroup(["Phone", "PC", "Tablet"], label="Allowed Devices", value=["PC"])
                         students_input_str = gr.Textbox(label="Students (Name,Email per line)", lines=5, placeholder="S. One,s1@ex.com\nS. Two,s2@ex.com")
-                btn_save = gr.Button("1. Save Setup & Generate Syllabus", variant="primary")
+                with gr.Row():
+                    btn_save = gr.Button("1. Save Setup & Generate Syllabus", variant="primary")
+                    batch_setup = gr.Checkbox(label="Batch mode (cheaper, done within 24h)", value=False)
                 gr.Markdown("---")
                 output_box = gr.Textbox(label="Output", lines=20, interactive=False, visible=False, show_copy_button=True)
                 with gr.Row(visible=False) as syllabus_actions_row:
                     btn_edit_syl = gr.Button(value="📝 Edit Syllabus Text")
                     btn_email_syl = gr.Button(value="📧 Email Syllabus", variant="secondary")
+                    bcc_syl = gr.Checkbox(label="One BCC email (no personal greeting)", value=False)
             with gr.TabItem("Lesson Plan Management"):
                 lesson_plan_setup_message = gr.Markdown(value="### Course Setup Required\nCourse Setup (on Tab 1) must be completed before generating a Lesson Plan.", visible=True)
                 course_load_for_plan = gr.Textbox(label="Course Name for Lesson Plan", placeholder="e.g., Introduction to Python", visible=False)
@@ -656,6 +1250,8 @@ def build_instructor_ui():
                     btn_generate_plan = gr.Button("2. Generate/Re-generate Lesson Plan", variant="primary")
                     btn_edit_plan = gr.Button(value="📝 Edit Plan Text")
                     btn_email_plan = gr.Button(value="📧 Email Lesson Plan", variant="secondary")
+                    batch_mode = gr.Checkbox(label="Batch mode (cheaper, done within 24h)", value=False)
+                    bcc_plan = gr.Checkbox(label="One BCC email (no personal greeting)", value=False)
             with gr.TabItem("Contact Support"):
                 gr.Markdown("### Send a Message to Support")
                 with gr.Row(): contact_name, contact_email_addr = gr.Textbox(label="Your Name"), gr.Textbox(label="Your Email Address")
@@ -675,12 +1271,12 @@ def build_instructor_ui():
                     else: return (gr.update(value="<span style='color:red;'>Failed to send. Check SMTP or logs.</span>"), gr.update(value=name), gr.update(value=email_addr), gr.update(value=message_text), gr.update(value=attachment_file))
                 btn_send_contact_email.click(handle_contact_submission, inputs=[contact_name, contact_email_addr, contact_message, contact_attachment], outputs=[contact_status_output, contact_name, contact_email_addr, contact_message, contact_attachment], queue=True)
         dummy_btn_1, dummy_btn_2, dummy_btn_3, dummy_btn_4 = gr.Button(visible=False), gr.Button(visible=False), gr.Button(visible=False), gr.Button(visible=False)
-        btn_save.click(save_setup, inputs=[course, instr, email, devices, pdf_file, sy, sm, sd_day, ey, em, ed_day, class_days_selected, students_input_str], outputs=[output_box, btn_save, dummy_btn_1, btn_generate_plan, btn_edit_syl, btn_email_syl, btn_edit_plan, btn_email_plan, syllabus_actions_row, plan_buttons_row, output_plan_box, lesson_plan_setup_message, course_load_for_plan])
+        btn_save.click(_with_progress(save_setup, 13, "⏳ Reading the PDF and generating the syllabus..."), inputs=[course, instr, email, devices, pdf_file, sy, sm, sd_day, ey, em, ed_day, class_days_selected, students_input_str, batch_setup], outputs=[output_box, btn_save, dummy_btn_1, btn_generate_plan, btn_edit_syl, btn_email_syl, btn_edit_plan, btn_email_plan, syllabus_actions_row, plan_buttons_row, output_plan_box, lesson_plan_setup_message, course_load_for_plan], concurrency_limit=2)
         btn_edit_syl.click(enable_edit_syllabus_and_reload, inputs=[course, output_box], outputs=[output_box])
-        btn_email_syl.click(email_syllabus_callback, inputs=[course, students_input_str, output_box], outputs=[output_box])
-        btn_generate_plan.click(generate_plan_callback, inputs=[course_load_for_plan], outputs=[output_plan_box, dummy_btn_2, dummy_btn_1, btn_generate_plan, dummy_btn_3, dummy_btn_4, btn_edit_plan, btn_email_plan]).then(lambda: (gr.update(visible=True), gr.update(visible=True)), outputs=[output_plan_box, plan_buttons_row])
+        btn_email_syl.click(email_syllabus_callback, inputs=[course, output_box, bcc_syl], outputs=[output_box])
+        btn_generate_plan.click(_with_progress(generate_plan_callback, 8, "⏳ Summarizing lesson segments and building the plan..."), inputs=[course_load_for_plan, batch_mode], outputs=[output_plan_box, dummy_btn_2, dummy_btn_1, btn_generate_plan, dummy_btn_3, dummy_btn_4, btn_edit_plan, btn_email_plan], concurrency_limit=2).then(lambda: (gr.update(visible=True), gr.update(visible=True)), outputs=[output_plan_box, plan_buttons_row])
         btn_edit_plan.click(enable_edit_plan_and_reload, inputs=[course_load_for_plan, output_plan_box], outputs=[output_plan_box])
-        btn_email_plan.click(email_plan_callback, inputs=[course_load_for_plan, students_input_str, output_plan_box], outputs=[output_plan_box])
+        btn_email_plan.click(email_plan_callback, inputs=[course_load_for_plan, output_plan_box, bcc_plan], outputs=[output_plan_box])
         course.change(lambda x: x, inputs=[course], outputs=[course_load_for_plan])
     return instructor_demo
 
@@ -804,7 +1400,7 @@ def build_student_tutor_ui():
                                 f"No config file found for this course ({course_id})."
                             )
                 
-                        cfg       = json.loads(cfg_path.read_text(encoding="utf-8"))
+                        cfg       = _load_cfg(cfg_path)
                         lessons   = cfg.get("lessons", [])
                         print(f"DEBUG: Config loaded. Number of lessons found: {len(lessons)}")
         
@@ -908,7 +1504,7 @@ def build_student_tutor_ui():
                     msg_content = f"Hello! I'm having a slight technical difficulty with my opening lines. How are you today?" # Default error message
     
                     try:
-                        client = openai.OpenAI()
+                        client = _openai_client()
                         print(f"PERF_DEBUG: Greeter LLM Start - {datetime.now(dt_timezone.utc).isoformat()}") # ADDED
                         res = client.chat.completions.create(model=STUDENT_CHAT_MODEL, messages=[{"role": "system", "content": prompt}], max_tokens=150)
                         msg_content = res.choices[0].message.content.strip()
@@ -935,7 +1531,7 @@ def build_student_tutor_ui():
                         # Attempt TTS for the fallback message
                         try:
                             print(f"PERF_DEBUG: Greeter Fallback TTS API Start - {datetime.now(dt_timezone.utc).isoformat()}") # ADDED
-                            client_fallback_tts = openai.OpenAI()
+                            client_fallback_tts = _openai_client()
                             speech_res_fallback = client_fallback_tts.audio.speech.create(model=STUDENT_TTS_MODEL, voice="nova", input=msg_content)
                             print(f"PERF_DEBUG: Greeter Fallback TTS API End - {datetime.now(dt_timezone.utc).isoformat()}") # ADDED
     
@@ -1009,7 +1605,7 @@ def build_student_tutor_ui():
                     if mic_path:
                         try:
                             print(f"PERF_DEBUG: STT Start - {datetime.now(dt_timezone.utc).isoformat()}") # ADDED
-                            client = openai.OpenAI()
+                            client = _openai_client()
                             with open(mic_path, "rb") as f:
                                 result = client.audio.transcriptions.create(file=f, model=STUDENT_WHISPER_MODEL)
                             input_text = result.text.strip()
@@ -1062,7 +1658,7 @@ def build_student_tutor_ui():
     
                     bot_reply = "An unexpected error occurred while generating my response." # Default
                     try:
-                        client = openai.OpenAI()
+                        client = _openai_client()
                         print(f"PERF_DEBUG: LLM Start - {datetime.now(dt_timezone.utc).isoformat()}") # ADDED
                         res = client.chat.completions.create(model=STUDENT_CHAT_MODEL, messages=chat_hist, max_tokens=250)
                         bot_reply = res.choices[0].message.content.strip()
@@ -1132,6 +1728,9 @@ def build_student_tutor_ui():
 # --- FastAPI App Setup (Continued) ---
 
 instructor_ui = build_instructor_ui()
+# Handlers are async (awaited OpenAI/SMTP I/O), so several users' events can run at once instead of one at a time;
+# max_size rejects new events once 64 are waiting instead of letting the queue grow without bound
+instructor_ui.queue(default_concurrency_limit=8, max_size=64)
 app = gr.mount_gradio_app(app, instructor_ui, path="/instructor")
 
 student_tutor_ui_instance = build_student_tutor_ui()
@@ -1206,8 +1805,40 @@ async def enter_class(token: str, code: str, request: Request): # --- ADDED ---
         print(f"Error in /class/enter: {e}\n{traceback.format_exc()}")
         return HTMLResponse(f"<h3>Unexpected error: {e}</h3>", status_code=500)
 
+# If more than one process serves this app (e.g. an instance restarted while the old one drains), each runs startup_event;
+# only the one holding this lock runs the scheduler and batch job poller, so reminders and progress alerts are sent once
+_scheduler_lock_file = None
+def _acquire_scheduler_lock():
+    global _scheduler_lock_file
+    try: import fcntl
+    except ImportError: return True
+    lock_file = open(CONFIG_DIR / "scheduler.lock", "w")
+    try: fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError: lock_file.close(); return False
+    _scheduler_lock_file = lock_file; return True
+
+# Collects finished Batch API jobs. Runs on the event loop of the worker that owns the scheduler, since the shared
+# async OpenAI client is bound to that loop. Each round reads only the small job metadata files; a job (metadata and
+# payload) is removed once its results have been applied
+async def _batch_job_poller():
+    advance = {"plan": _advance_plan_job, "setup": _advance_setup_job}
+    while True:
+        for path in sorted(BATCH_JOBS_DIR.glob("*.json")):
+            try:
+                job = _read_json(path)
+                if job["next_poll_at"] > time.time(): continue
+                batch_id = job["batch_id"]
+                if await advance[job["kind"]](job): _remove_batch_job(job["id"]); print(f"Batch job {job['id']} ({job['kind']}) finished.")
+                # Still running: back off (a job that just resubmitted a follow-up batch has already been rescheduled)
+                elif job["batch_id"] == batch_id: _schedule_batch_poll(job, min(job["poll_secs"] * 2, _BATCH_POLL_MAX_SECS)); _save_batch_job(job)
+            except Exception as e: print(f"Error advancing batch job {path.name}: {e}\n{traceback.format_exc()}")
+        await asyncio.sleep(_BATCH_POLL_SECS)
+
+_batch_job_task = None
 @app.on_event("startup")
 async def startup_event():
+    global _batch_job_task
+    if not _acquire_scheduler_lock(): print(f"APScheduler not started in worker {os.getpid()}: another worker owns the scheduler."); return
     scheduler.add_job(send_daily_class_reminders, trigger=CronTrigger(hour=5, minute=50, timezone='UTC'), id="daily_reminders", name="Daily Class Reminders", replace_existing=True)
     scheduler.add_job(check_student_progress_and_notify_professor, trigger=CronTrigger(hour=18, minute=0, timezone='UTC'), id="progress_check", name="Student Progress Check", replace_existing=True)
     if not scheduler.running:
@@ -1219,17 +1850,25 @@ async def startup_event():
     else:
         print("APScheduler already running.")
     for job in scheduler.get_jobs(): print(f"  Job: {job.id}, Name: {job.name}, Trigger: {job.trigger}")
+    _batch_job_task = asyncio.create_task(_batch_job_poller())
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    if _batch_job_task: _batch_job_task.cancel()
     if scheduler.running:
         scheduler.shutdown()
         print("APScheduler shutdown.")
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["batch-setup"]:
+        # Submit-and-return: the running server's batch job poller saves the courses once the batch completes
+        for status in asyncio.run(submit_setup_batch(_read_json(Path(sys.argv[2])))): print(status)
+        raise SystemExit(0)
     print(f"Starting App. Instructor Panel at /instructor. Student access via /class?token=...")
     print(f"Student Tutor UI should be available at {STUDENT_UI_PATH} (after /class redirect)")
-    # Example: uvicorn main:app --reload --port 8000
-    # (Assuming your file is named main.py)
-    # The uvicorn command handles running the FastAPI app and its lifecycle.
-    pass
+    # One worker process: the mounted Gradio apps keep queue and session state in memory, so several workers would need
+    # sticky sessions in front of them. PDF parsing already runs in worker threads; loop/http "auto" pick uvloop/httptools
+    # when installed (uvicorn[standard]). The app object is passed directly: an import string would make uvicorn import this
+    # file a second time as a module and rebuild both Gradio UIs, the app and the scheduler
+    import uvicorn
+    uvicorn.run(app, host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", 8000)), loop="auto", http="auto")